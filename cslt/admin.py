@@ -1,15 +1,19 @@
+import csv
+import itertools
+import json
 from datetime import datetime
 
 from django.contrib import admin
-from django.contrib.auth.models import User
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, \
+  StreamingHttpResponse
 from django.template import loader
 from django.views import View
 
 from cslt import config, settings
 from cslt.serializers import VideoSerializer
-from .models import Video, Gloss, Category, Score, VideoStatus
+from cslt.services import load_video_list, get_statistics, iter_by_id
+from .models import Video, Gloss, Category, VideoStatus
 
 
 admin.site.register(Video)
@@ -20,46 +24,7 @@ admin.site.register(Category)
 class StatisticView(View):
   def get(self, request):
     template = loader.get_template('statistic.html')
-
-    user_stats = User.objects.raw('SELECT auth_user.id, username, COUNT(cslt_video.id) as total_count FROM `cslt_video` JOIN auth_user ON auth_user.id = cslt_video.user_id WHERE cslt_video.status > 4 GROUP BY user_id;')
-    result = {o.id: o.__dict__ for o in user_stats}
-
-    user_stats = User.objects.raw('SELECT auth_user.id, username, COUNT(cslt_video.id) as total_count FROM `cslt_video` JOIN auth_user ON auth_user.id = cslt_video.user_id WHERE cslt_video.status = 6 GROUP BY user_id;')
-    for o in user_stats:
-      result[o.id]['pending_count'] = o.total_count
-    user_stats = User.objects.raw('SELECT auth_user.id, username, COUNT(cslt_video.id) as total_count FROM `cslt_video` JOIN auth_user ON auth_user.id = cslt_video.user_id WHERE cslt_video.status = 7 GROUP BY user_id;')
-    for o in user_stats:
-      result[o.id]['approved_count'] = o.total_count
-    user_stats = User.objects.raw('SELECT auth_user.id, username, COUNT(cslt_video.id) as total_count FROM `cslt_video` JOIN auth_user ON auth_user.id = cslt_video.user_id WHERE cslt_video.status = 5 GROUP BY user_id;')
-    for o in user_stats:
-      result[o.id]['rejected_count'] = o.total_count
-
-    daily_stats = Video.objects.raw("SELECT 1 as id, from_unixtime(cslt_video.created_time, '%%Y-%%m-%%d') as `date`, COUNT(cslt_video.id) FROM `cslt_video` WHERE cslt_video.status > 0 GROUP BY `date`")
-    daily_stats = [o.__dict__ for o in daily_stats]
-
-    score_stats = []
-    for id in result.keys():
-      scores = Score.objects.raw('''
-        SELECT 1 as id, `cslt_score`.`score_type`, SUM(`cslt_score`.`value`) AS `total`, COUNT(`cslt_score`.`value`) AS `count` 
-          FROM `cslt_score` INNER JOIN `cslt_video` ON (`cslt_score`.`video_id` = `cslt_video`.`id`) 
-          INNER JOIN `cslt_gloss` ON (`cslt_video`.`gloss_id` = `cslt_gloss`.`id`) 
-          WHERE (`cslt_gloss`.`gloss_type` <> 0 AND ((`cslt_score`.`user_id` = {0} AND NOT (`cslt_score`.`score_type` = 4 AND `cslt_score`.`score_type` IS NOT NULL)) 
-            OR (`cslt_score`.`video_owner_id` = {0} AND `cslt_score`.`score_type` = 4))) 
-          GROUP BY `cslt_score`.`score_type` ORDER BY `cslt_score`.`score_type`;'''.format(id))
-      score_map = {o.score_type: o.total for o in scores}
-      score_stats.append({
-        'username': result[id]['username'],
-        'created_video_score': score_map[2] if 2 in score_map else 0,
-        'approved_video_score': score_map[4] if 4 in score_map else 0,
-        'review_video_score': score_map[1] if 1 in score_map else 0,
-        'total_score': sum(score_map.values())
-      })
-
-    return HttpResponse(template.render({
-      'user_stats': result.values(),
-      'daily_stats': daily_stats,
-      'score_stats': score_stats
-    }, request))
+    return HttpResponse(template.render(get_statistics(), request))
 
 
 class GlossesView(View):
@@ -73,7 +38,7 @@ class GlossesView(View):
 
 class GlossesVideoView(View):
   def get(self, request, gloss_id):
-    videos = Video.objects.select_related('user').filter(gloss_id=gloss_id, status__gt=VideoStatus.SAMPLE)
+    videos = load_video_list(Video.objects.filter(gloss_id=gloss_id, status__gt=VideoStatus.SAMPLE))
 
     video_serializer = VideoSerializer(videos, many=True)
     result = {
@@ -90,25 +55,97 @@ class GlossesVideoView(View):
     }, request))
 
 
+class Echo(object):
+  """A file-like object returning what is written, for csv.writer."""
+
+  def write(self, value):
+    return value
+
+
 class GlossesDownloadView(View):
+  """
+  Export the training videos, of a gloss or of all glosses, as a wget shell
+  script (format=sh, the default) or as a csv or jsonl manifest. The export
+  is streamed, videos are loaded settings.EXPORT_CHUNK_SIZE at a time.
+  """
+  MANIFEST_FIELDS = ('uuid', 'gloss_id', 'gloss_text', 'username', 'status',
+                     'created_time', 'url', 'duration', 'width', 'height',
+                     'fps', 'sha256')
+
   def get(self, request, gloss_id=None):
-      videos = Video.objects.select_related('gloss').select_related('user').filter(~Q(user_id=config.SAMPLE_VIDEO_USER_ID), status__gte=VideoStatus.REJECTED)
-      if gloss_id:
-        videos = videos.filter(gloss_id=gloss_id)
-      commands = []
-      prefix = ''
-      for video in videos:
-        if not prefix and gloss_id:
-          prefix = video.gloss.text + '-'
-        command = 'wget -O {gt}-{username}-{status}-{time}.mp4 {base_url}{video_path}'.format(
-            gt=video.gloss.text,
-            username=video.user.username,
-            time=datetime.utcfromtimestamp(video.created_time).strftime('%Y%m%d%H%M%S'),
-            base_url='' if str(video.video_path)[:4] == 'http' else request.get_host(),
-            status=VideoStatus(video.status).name,
-            video_path=video.video_path
-          )
-        commands.append(command)
-      response = HttpResponse('\n'.join(commands), content_type='application/x-sh')
-      response['Content-Disposition'] = 'attachment; filename="{}batch-download.sh"'.format(prefix)
-      return response
+    export_format = request.GET.get('format', 'sh')
+    if export_format not in ('sh', 'csv', 'jsonl'):
+      return HttpResponseBadRequest('Unknown format')
+
+    videos = Video.objects.select_related('gloss', 'user').filter(
+      ~Q(user_id=config.SAMPLE_VIDEO_USER_ID),
+      status__gte=VideoStatus.REJECTED).only(
+      'id', 'uuid', 'status', 'created_time', 'video_path', 'duration',
+      'width', 'height', 'fps', 'sha256', 'gloss__id', 'gloss__text',
+      'user__id', 'user__username')
+    prefix = ''
+    if gloss_id:
+      videos = videos.filter(gloss_id=gloss_id)
+      text = Gloss.objects.filter(id=gloss_id).values_list(
+        'text', flat=True).first()
+      if text:
+        prefix = text + '-'
+    # Duration bounds in seconds, videos not probed yet are left out.
+    try:
+      if request.GET.get('min_duration'):
+        videos = videos.filter(
+          duration__gte=float(request.GET['min_duration']))
+      if request.GET.get('max_duration'):
+        videos = videos.filter(
+          duration__lte=float(request.GET['max_duration']))
+    except ValueError:
+      return HttpResponseBadRequest('Invalid duration')
+
+    rows = (self.manifest_row(request, video)
+            for video in iter_by_id(videos, settings.EXPORT_CHUNK_SIZE))
+    if export_format == 'csv':
+      writer = csv.writer(Echo())
+      lines = itertools.chain([writer.writerow(self.MANIFEST_FIELDS)], (
+        writer.writerow([row[field] for field in self.MANIFEST_FIELDS])
+        for row in rows))
+      content_type, filename = 'text/csv', 'manifest.csv'
+    elif export_format == 'jsonl':
+      lines = (json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+      content_type, filename = 'application/x-ndjson', 'manifest.jsonl'
+    else:
+      lines = (self.wget_command(row) + '\n' for row in rows)
+      content_type, filename = 'application/x-sh', 'batch-download.sh'
+
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{}{}"'.format(
+      prefix, filename)
+    return response
+
+  @staticmethod
+  def manifest_row(request, video):
+    video_path = str(video.video_path)
+    return {
+      'uuid': video.uuid,
+      'gloss_id': video.gloss.id,
+      'gloss_text': video.gloss.text,
+      'username': video.user.username,
+      'status': VideoStatus(video.status).name,
+      'created_time': video.created_time,
+      'url': video_path if video_path[:4] == 'http'
+      else request.get_host() + video_path,
+      'duration': video.duration,
+      'width': video.width,
+      'height': video.height,
+      'fps': video.fps,
+      'sha256': video.sha256,
+    }
+
+  @staticmethod
+  def wget_command(row):
+    return 'wget -O {gt}-{username}-{status}-{time}.mp4 {url}'.format(
+      gt=row['gloss_text'],
+      username=row['username'],
+      status=row['status'],
+      time=datetime.utcfromtimestamp(row['created_time']).strftime(
+        '%Y%m%d%H%M%S'),
+      url=row['url'])
@@ -0,0 +1,180 @@
+"""
+In-process allocator of training video recording tasks.
+
+The allocator ranks the glosses that still need training videos, i.e. those
+with fewer than settings.DEFAULT_TARGET_TRAINING_VIDEO_COUNT_PER_GLOSS
+approved videos, by their number of recordings (approved and pending
+approval videos). Glosses with the fewest recordings are handed out first.
+Each user starts at a different place among glosses of equal rank, so that
+users do not all record the same glosses.
+
+The gloss counters are loaded from the database when the process starts, or
+on first use, and kept up to date by the write paths of this process. A
+background thread reloads them every
+settings.RECORDING_ALLOCATOR_REFRESH_INTERVAL seconds to pick up changes made
+by other processes. The users' recorded counts are loaded on demand and
+reloaded after the same interval.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.db.models import Count
+
+from cslt import config, settings
+from cslt.utils import BackgroundBuilt
+
+# Number of users whose recorded counts are kept in memory.
+USER_CACHE_SIZE = 1000
+
+
+class _Bucket(object):
+  """A set of gloss ids supporting O(1) add, remove and indexing."""
+
+  def __init__(self):
+    self.ids = []
+    self._positions = {}
+
+  def __len__(self):
+    return len(self.ids)
+
+  def add(self, id):
+    if id not in self._positions:
+      self._positions[id] = len(self.ids)
+      self.ids.append(id)
+
+  def remove(self, id):
+    position = self._positions.pop(id, None)
+    if position is None:
+      return
+    last = self.ids.pop()
+    if last != id:
+      self.ids[position] = last
+      self._positions[last] = position
+
+
+class RecordingAllocator(BackgroundBuilt):
+  thread_name = 'recording-allocator'
+
+  def __init__(self):
+    super(RecordingAllocator, self).__init__()
+    self._lock = threading.Lock()
+    # gloss id -> [approved count, pending approval count]
+    self._glosses = {}
+    # recording count -> bucket of glosses still needing videos
+    self._buckets = defaultdict(_Bucket)
+    # user id -> (load time, {gloss id: video count})
+    self._users = OrderedDict()
+
+  def _place(self, id):
+    approved, pending = self._glosses[id]
+    if approved < settings.DEFAULT_TARGET_TRAINING_VIDEO_COUNT_PER_GLOSS:
+      self._buckets[approved + pending].add(id)
+
+  def _displace(self, id):
+    approved, pending = self._glosses[id]
+    bucket = self._buckets.get(approved + pending)
+    if bucket is not None:
+      bucket.remove(id)
+      if not bucket:
+        del self._buckets[approved + pending]
+
+  def build(self):
+    """Load the counters of every gloss recordings can be assigned to."""
+    from cslt.models import Gloss
+
+    allocator = RecordingAllocator()
+    for id, approved, pending in Gloss.objects.filter(
+        gloss_type__gt=0).values_list(
+        'id', 'approved_video_count', 'pending_approval_video_count'
+    ).iterator():
+      allocator._glosses[id] = [approved or 0, pending or 0]
+      allocator._place(id)
+    with self._lock:
+      self._glosses, self._buckets = allocator._glosses, allocator._buckets
+      self._users.clear()
+      self._built_time = time.time()
+
+  def refresh_interval(self):
+    return settings.RECORDING_ALLOCATOR_REFRESH_INTERVAL
+
+  def set_gloss(self, id, gloss_type, approved, pending):
+    """Take the type and counters of a new or changed gloss."""
+    with self._lock:
+      if self._built_time is None:
+        return
+      if id in self._glosses:
+        self._displace(id)
+        del self._glosses[id]
+      if gloss_type > 0:
+        self._glosses[id] = [approved or 0, pending or 0]
+        self._place(id)
+
+  def update_gloss(self, id, approved_video_count=0,
+                   pending_approval_video_count=0, **deltas):
+    """Apply the counter changes made by services.update_gloss_counters."""
+    with self._lock:
+      if id not in self._glosses:
+        return
+      self._displace(id)
+      counters = self._glosses[id]
+      counters[0] += approved_video_count
+      counters[1] += pending_approval_video_count
+      self._place(id)
+
+  def add_user_videos(self, user_id, gloss_ids):
+    """Count new videos of a user, a no-op for users not in memory."""
+    with self._lock:
+      if user_id in self._users:
+        counts = self._users[user_id][1]
+        for gloss_id in gloss_ids:
+          counts[gloss_id] = counts.get(gloss_id, 0) + 1
+
+  def _user_counts(self, user_id):
+    from cslt.models import Video
+
+    with self._lock:
+      loaded = self._users.get(user_id)
+      if loaded is not None and time.time() - loaded[0] < \
+          settings.RECORDING_ALLOCATOR_REFRESH_INTERVAL:
+        self._users.move_to_end(user_id)
+        return loaded[1]
+
+    counts = dict(Video.objects.filter(user_id=user_id).values(
+      'gloss_id').annotate(count=Count('id')).values_list(
+      'gloss_id', 'count').order_by())
+    with self._lock:
+      self._users[user_id] = (time.time(), counts)
+      while len(self._users) > USER_CACHE_SIZE:
+        self._users.popitem(last=False)
+    return counts
+
+  def allocate(self, user_id, count):
+    """
+    Pick up to count glosses for a user to record.
+
+    Glosses the user has recorded more than config.ONE_GLOSS_RECORDING_LIMIT
+    times are skipped.
+
+    :return: a list of gloss ids, least recorded first.
+    """
+    self.ensure_built()
+    user_counts = self._user_counts(user_id)
+
+    gloss_ids = []
+    with self._lock:
+      for recordings in sorted(self._buckets):
+        ids = self._buckets[recordings].ids
+        # Knuth's multiplicative hash spreads users over the bucket.
+        start = user_id * 2654435761 % len(ids)
+        for i in range(len(ids)):
+          id = ids[(start + i) % len(ids)]
+          if user_counts.get(id, 0) > config.ONE_GLOSS_RECORDING_LIMIT:
+            continue
+          gloss_ids.append(id)
+          if len(gloss_ids) >= count:
+            return gloss_ids
+    return gloss_ids
+
+
+recording_allocator = RecordingAllocator()
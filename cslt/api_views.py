@@ -1,22 +1,20 @@
 import time
 
-from django.http import HttpResponse
 from rest_framework import views
 from rest_framework.response import Response
+from django.db import transaction
 from django.db.models import Q, Sum, Count
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.utils.translation import ugettext_lazy as _
 
-from cslt import services, config
-from cslt.models import Category, Video, Score, VideoStatus, Gloss, ScoreType, \
-  GlossType, ScoreValue
+from cslt import services, config, search, uploads, mp4, media
+from cslt.allocator import recording_allocator
+from cslt.models import Category, Video, Score, VideoStatus, Gloss, GlossType
 from cslt.serializers import *
 from rest_framework_simplejwt.views import TokenError, TokenViewBase
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, \
   TokenRefreshSerializer
 
-from cslt.services import update_video_and_gloss_by_review
-from cslt.services import update_video_and_gloss_by_new_upload
 
 from cslt.utils import Convert
 
@@ -103,11 +101,10 @@ An endpoint for changing password.
 
 class AuthMediaView(views.APIView):
   def get(self, request, path):
-    response = HttpResponse()
-    response["Content-Disposition"] = "attachment; filename={0}".format(
-      path.split('/')[-1])
-    response['X-Accel-Redirect'] = "/media/{0}".format(path)
-    return response
+    """
+Send a media file, supporting byte ranges and conditional requests.
+"""
+    return media.serve(request, path)
 
 
 class AgreementView(views.APIView):
@@ -175,9 +172,17 @@ class DictionaryView(views.APIView):
 
     qs = request.GET
 
-    if 'q' in qs:
+    if 'cid' in qs:
+      try:
+        categories = [int(c) for c in qs['cid'].split(',')]
+      except ValueError:
+        return Response(build_resp(code=6701, message=_('Parameters error')))
+      glosses = glosses.filter(id__in=services.category_gloss_ids(categories))
+
+    if qs.get('q'):
       query = qs['q']
-      glosses = glosses.filter(text__istartswith=query)
+      glosses = glosses.filter(
+        id__in=search.search_glosses(query, prefix=True))
 
     glosses = glosses.order_by(Convert('text', 'gbk').asc())
 
@@ -188,8 +193,13 @@ class DictionaryView(views.APIView):
       offset = 0
       limit = settings.PAGE_SIZE
 
-    total = glosses.count()
-    glosses = glosses.all()[offset: offset + limit]
+    params = {'view': 'dictionary', 'q': qs.get('q'), 'cid': qs.get('cid')}
+    total = services.count_total('glosses', params, glosses,
+                                 qs.get('total', 'exact'))
+    glosses = list(glosses.all()[offset: offset + limit + 1])
+    if total is None:
+      total = offset + len(glosses)
+    glosses = glosses[:limit]
 
     serializer = GlossSerializer(glosses, many=True)
     resp = {
@@ -210,9 +220,17 @@ class GlossView(views.APIView):
 
     qs = request.GET
 
-    if 'q' in qs:
+    if 'cid' in qs:
+      try:
+        categories = [int(c) for c in qs['cid'].split(',')]
+      except ValueError:
+        return Response(build_resp(code=6701, message=_('Parameters error')))
+      glosses = glosses.filter(id__in=services.category_gloss_ids(categories))
+
+    if qs.get('q'):
       query = qs['q']
-      glosses = glosses.filter(text__icontains=query).order_by('text')
+      glosses = glosses.filter(
+        id__in=search.search_glosses(query)).order_by('text')
     elif order == 'latest':
       glosses = glosses.order_by('-created_time')
     elif order == 'recommend':
@@ -227,8 +245,14 @@ class GlossView(views.APIView):
       offset = 0
       limit = settings.PAGE_SIZE
 
-    total = glosses.count()
-    glosses = glosses.all()[offset: offset + limit]
+    params = {'view': 'glosses', 'order': order, 'q': qs.get('q'),
+              'cid': qs.get('cid')}
+    total = services.count_total('glosses', params, glosses,
+                                 qs.get('total', 'exact'))
+    glosses = list(glosses.all()[offset: offset + limit + 1])
+    if total is None:
+      total = offset + len(glosses)
+    glosses = glosses[:limit]
 
     serializer = GlossSerializer(glosses, many=True)
     resp = {
@@ -256,14 +280,21 @@ return paged video entries with filters of request get params.
     * author ( user id, special value: self,
                if null the api will return a list without self video. )
     * query ( any text in gloss label )
-    * categories ( comma separated numbers, categories id )
+    * cid ( comma separated numbers, categories id, subcategories included )
     * offset ( the result offset to start shown )
-    * limit ( the list maximum length )
+    * limit ( the list maximum length, from 1 to MAX_PAGE_SIZE )
+    * cursor ( switches to cursor paging, pass an empty value for the first
+               page and the returned next_cursor for the following pages )
+    * order ( latest|quality, sorts by descending created time or video
+              quality score )
+    * total ( exact|approx, approx returns the last known total instead of
+              counting, exact is the default in offset paging )
 
 Example:
   /api/videos
   /api/videos?author=self
   /api/videos?author=1&limit=10
+  /api/videos/unreviewed?cursor=&limit=20
 
 get:
 
@@ -282,7 +313,7 @@ Returns:
 """
     if id and id not in ['self', 'unreviewed']:
       try:
-        video = Video.objects.get(uuid=id)
+        video = services.load_video_list(Video.objects).get(uuid=id)
       except Video.DoesNotExist:
         return Response(build_resp(COMMON_URL_ERROR))
 
@@ -308,7 +339,11 @@ Returns:
       except (KeyError, IndexError):
         pass
 
-    data, next_offset, total = services.get_videos(request.user, qs, status)
+    try:
+      data, next_offset, total, next_cursor = services.get_videos(
+        request.user, qs, status)
+    except ValueError:
+      return Response(build_resp(code=6701, message=_('Parameters error')))
     video_serializer = VideoSerializer(data, many=True)
     result = video_serializer.data if len(data) > 0 else []
     for item in result:
@@ -318,6 +353,8 @@ Returns:
       'next': next_offset,
       'data': result
     }
+    if 'cursor' in qs:
+      data['next_cursor'] = next_cursor
 
     resp = build_resp(data)
 
@@ -331,6 +368,7 @@ post:
   {
     "gloss_id": number|number list
   }
+  numeric strings are accepted as gloss ids.
   return video uuid|uuid list (named "upload_key"), you can use this uuid to
   get video info, or upload video.
 Args:
@@ -340,7 +378,7 @@ Returns:
 
 """
     try:
-      if type(request.data['gloss_id']) == int:
+      if type(request.data['gloss_id']) in (int, str):
         glosses = [request.data['gloss_id']]
       else:
         glosses = request.data['gloss_id']
@@ -350,12 +388,34 @@ Returns:
     if not isinstance(glosses, list):
       return Response(build_resp(code=6701, message=_('Parameters error')))
 
-    uuids = services.create_videos(request.user, glosses)
+    try:
+      uuids = services.create_videos(request.user, glosses)
+    except ValueError:
+      return Response(build_resp(code=6701, message=_('Parameters error')))
 
     resp = build_resp({'upload_key': uuids})
     return Response(resp)
 
 
+def check_upload_permission(video, user_id):
+  """Return the error response if the user may not upload the video."""
+  if video.user_id != user_id:
+    return build_resp(
+      code=50070, message=_('No permission to upload this video'))
+
+  if video.status in UPLOAD_FORBIDDENED_VIDEO_STATUS:
+    return build_resp(
+      code=50071,
+      message=_('Invalid upload, The video has been forbidden/deleted'))
+  return None
+
+
+def reject_upload(*paths):
+  """Delete the stored files of a rejected upload."""
+  for path in paths:
+    uploads.discard_file(uploads.storage_name(path))
+
+
 class UploadView(views.APIView):
   parser_classes = (MultiPartParser, FormParser)
 
@@ -364,7 +424,11 @@ class UploadView(views.APIView):
 Upload video file server.
 
 This api needs multipart/form-data form post, the file field is named 'file'.
-The upload file type only supports 'video/mp4'.
+The upload file type only supports 'video/mp4'. The video is streamed to the
+storage, the response gives its 'size' and 'sha256' checksum. Malformed mp4
+files and videos shorter than MIN_VIDEO_DURATION are rejected. A file whose
+movie box comes last is replaced by a faststart copy in the background, the
+response gives the uploaded file.
 
 Examples:
   /api/videos/b2121b40-7c21-486f-b8a5-8dd91f5b80a8/upload
@@ -379,45 +443,237 @@ Examples:
       return Response(build_resp(COMMON_URL_ERROR))
 
     user_id = request.user.id
-    if video.user_id != user_id:
-      resp = build_resp(
-        code=50070, message=_('No permission to upload this video'))
-      return Response(resp)
-
-    if video.status in UPLOAD_FORBIDDENED_VIDEO_STATUS:
-      resp = build_resp(
-        code=50071,
-        message=_('Invalid upload, The video has been forbidden/deleted'))
+    resp = check_upload_permission(video, user_id)
+    if resp:
       return Response(resp)
 
+    # Stream the video to the storage while the body is parsed.
+    request.upload_handlers.insert(0, uploads.StorageUploadHandler(request))
     request.data['user_id'] = user_id
     request.data['uuid'] = id
     vs = VideoUploadSerializer(data=request.data)
+    # The stored files of the upload, deleted if it fails.
+    stored = []
+    upload = request.FILES.get('video')
+    if isinstance(upload, uploads.StoredUpload):
+      stored.append(upload.storage_name)
+
+    try:
+      if not vs.is_valid():
+        reject_upload(*stored)
+        resp = build_resp(code=500, message=_('Error occurred'))
+        return Response(resp)
 
-    if vs.is_valid():
       try:
         vs.save()
       except Exception as e:
+        reject_upload(*stored)
         resp = build_resp(code=400, message=e.args[0])
         return Response(resp)
+      stored = [path for path in (vs.validated_data['video'],
+                                  vs.validated_data['thumbnail'])
+                if isinstance(path, str)]
 
-      update_video_and_gloss_by_new_upload(video, vs.validated_data['video'],
-                                           vs.validated_data['thumbnail'])
+      try:
+        metadata = uploads.probe_video(
+          uploads.storage_name(vs.validated_data['video']))
+      except mp4.InvalidMp4 as e:
+        reject_upload(*stored)
+        return Response(build_resp(code=50074, message=str(e)))
+
+      data = dict(vs.validated_data)
+      if isinstance(upload, uploads.StoredUpload):
+        data.update(size=upload.size, sha256=upload.sha256)
+      data['video'] = services.complete_upload(
+        video, user_id, vs.validated_data['video'],
+        vs.validated_data['thumbnail'], data.get('sha256'), metadata)
+    except Exception:
+      reject_upload(*stored)
+      raise
 
-      score = Score(user_id=request.user.id,
-                    video_id=video.id,
-                    video_owner_id=request.user.id,
-                    score_type=ScoreType.CREATE_VIDEO,
-                    value=ScoreValue.CREATE_VIDEO,
-                    created_time=int(time.time()))
-      score.save()
+    resp = build_resp(data)
+    return Response(resp)
 
-      resp = build_resp(vs.validated_data)
-      return Response(resp)
-    else:
-      resp = build_resp(code=500, message=_('Error occurred'))
+
+class ResumableUploadView(views.APIView):
+  def post(self, request, id):
+    """
+Start a resumable upload of a video file.
+
+The json body gives the 'size' in bytes, the 'filename' and the
+'content_type' of the file, which must be 'video/mp4', and optionally its
+'sha256' checksum. The response holds the 'upload_id' of the upload, the
+'offset' to send chunks from and the 'chunk_size' limit of its chunks. The
+offset is the size when the same content is stored already, the upload can
+be finalized right away.
+
+Examples:
+  /api/videos/b2121b40-7c21-486f-b8a5-8dd91f5b80a8/uploads
+  {"size": 10485760, "filename": "video.mp4", "content_type": "video/mp4"}
+"""
+    try:
+      video = Video.objects.get(uuid=id)
+    except Video.DoesNotExist:
+      return Response(build_resp(COMMON_URL_ERROR))
+
+    user_id = request.user.id
+    resp = check_upload_permission(video, user_id)
+    if resp:
       return Response(resp)
 
+    try:
+      upload_id = uploads.create_session(
+        video, user_id, str(request.data.get('filename', 'video.mp4')),
+        int(request.data.get('size', 0)), request.data.get('content_type'),
+        request.data.get('sha256'))
+    except (TypeError, ValueError) as e:
+      return Response(build_resp(code=6701, message=str(e)))
+
+    return Response(build_resp({
+      'upload_id': upload_id,
+      'offset': uploads.get_offset(uploads.get_session(upload_id)),
+      'chunk_size': settings.UPLOAD_CHUNK_MAX_SIZE,
+    }))
+
+
+def get_upload_session(upload_id, user_id):
+  session = uploads.get_session(upload_id)
+  if session is None or session['user_id'] != user_id:
+    return None
+  return session
+
+
+class UploadSessionView(views.APIView):
+  def get(self, request, upload_id):
+    """
+Get the progress of a resumable upload, the 'offset' the next chunk starts at.
+
+Examples:
+  /api/uploads/6f1b4ac1f2f94b6c8c0d3d3e4cbb4d7e
+"""
+    session = get_upload_session(upload_id, request.user.id)
+    if session is None:
+      return Response(build_resp(COMMON_URL_ERROR))
+
+    return Response(build_resp({
+      'upload_id': session['upload_id'],
+      'offset': uploads.get_offset(session),
+      'size': session['size'],
+    }))
+
+  def put(self, request, upload_id):
+    """
+Send the next chunk of a resumable upload as the raw request body.
+
+The chunk must start at the current offset of the upload, given by the
+'offset' query parameter. A chunk sent at another offset is refused with the
+current offset, so that the client can resume from there.
+
+Examples:
+  /api/uploads/6f1b4ac1f2f94b6c8c0d3d3e4cbb4d7e?offset=8388608
+"""
+    session = get_upload_session(upload_id, request.user.id)
+    if session is None:
+      return Response(build_resp(COMMON_URL_ERROR))
+
+    try:
+      offset = int(request.query_params.get('offset', ''))
+      length = int(request.META.get('CONTENT_LENGTH') or 0)
+      offset = uploads.write_chunk(session, offset, request.stream, length)
+    except uploads.OffsetMismatch as e:
+      return Response(build_resp(
+        {'offset': e.offset}, code=50072, message=_('Upload offset mismatch')))
+    except ValueError as e:
+      return Response(build_resp(code=6701, message=str(e)))
+
+    return Response(build_resp({
+      'upload_id': session['upload_id'],
+      'offset': offset,
+      'size': session['size'],
+    }))
+
+
+class UploadFinalizeView(views.APIView):
+  parser_classes = (MultiPartParser, FormParser)
+
+  def post(self, request, upload_id):
+    """
+Finish a resumable upload once all its chunks are sent.
+
+This api needs multipart/form-data form post with the video thumbnail, like
+the upload api. A retried request gets the response of the first one.
+
+Examples:
+  /api/uploads/6f1b4ac1f2f94b6c8c0d3d3e4cbb4d7e/finalize
+  Content-Disposition: form-data; name="thumbnail"; filename="thumbnail.png"
+  Content-Type: image/png
+"""
+    user_id = request.user.id
+    session = get_upload_session(upload_id, user_id)
+    if session is None:
+      return Response(build_resp(COMMON_URL_ERROR))
+    if session.get('response') is not None:
+      # A retry of a finalize request whose response was lost.
+      return Response(session['response'])
+
+    thumb = request.data.get('thumbnail')
+    if thumb is None or thumb.content_type != 'image/png':
+      return Response(build_resp(
+        code=400, message='The uploaded file is not supported'))
+
+    # The stored files of the upload, deleted if it fails.
+    stored = []
+    try:
+      with transaction.atomic():
+        # Concurrent retries wait for the first request, then give its
+        # response.
+        video = Video.objects.select_for_update().filter(
+          uuid=session['uuid']).first()
+        session = get_upload_session(upload_id, user_id)
+        if video is None or session is None:
+          return Response(build_resp(COMMON_URL_ERROR))
+        if session.get('response') is not None:
+          return Response(session['response'])
+        resp = check_upload_permission(video, user_id)
+        if resp:
+          return Response(resp)
+
+        try:
+          video_path, sha256 = uploads.finalize(session)
+        except ValueError as e:
+          return Response(build_resp(
+            {'offset': uploads.get_offset(session)}, code=50073,
+            message=str(e)))
+        stored.append(video_path)
+        try:
+          metadata = uploads.probe_video(video_path)
+        except mp4.InvalidMp4 as e:
+          reject_upload(video_path)
+          resp = build_resp(code=50074, message=str(e))
+          uploads.close_session(session, resp)
+          return Response(resp)
+        thumbnail_path = default_storage.save(get_upload_url(thumb.name),
+                                              thumb)
+        stored.append(thumbnail_path)
+
+        video_path = os.path.join(settings.MEDIA_URL, video_path)
+        thumbnail_path = os.path.join(settings.MEDIA_URL, thumbnail_path)
+        video_path = services.complete_upload(video, user_id, video_path,
+                                              thumbnail_path, sha256, metadata)
+
+        resp = build_resp({
+          'uuid': video.uuid,
+          'user_id': user_id,
+          'video': video_path,
+          'thumbnail': thumbnail_path,
+        })
+        uploads.close_session(session, resp)
+    except Exception:
+      # Once rolled back, a file stored by complete_upload is no shared blob.
+      reject_upload(*stored)
+      raise
+    return Response(resp)
+
 
 # </editor-fold>
 
@@ -440,60 +696,90 @@ class ScoreView(views.APIView):
     return Response(build_resp(score_values))
 
   def post(self, request, uuid, action=None):
-    try:
-      video = Video.objects.get(uuid=uuid)
-    except Video.DoesNotExist:
+    action = VideoStatus.APPROVED if action == 'approve' else VideoStatus.REJECTED
+    result = services.review_videos(request.user.id, [(uuid, action)])[0]
+    if result['code'] == 404:
       return Response(build_resp(COMMON_URL_ERROR))
+    if result['code']:
+      return Response(build_resp(code=result['code'],
+                                 message=result['message']))
 
-    if video.user.id == request.user.id:
-      resp = build_resp(code=50061, message=_('User cannot review self video'))
-      return Response(resp)
-
-    if Gloss.objects.filter(sample_video_id=video.id).exists():
-      resp = build_resp(code=50062, message=_('Forbid voting a sample video'))
-      return Response(resp)
+    user_scores = services.get_user_scores(request.user.id)
+    data = {
+      'uuid': uuid,
+      'value': 1,
+      'video_score': result['video_score'],
+      'user_scores': user_scores
+    }
+    return Response(build_resp(data))
 
-    # reviewer score
-    try:
-      score = Score.objects.get(user_id=request.user.id, video_id=video.id,
-                                score_type=1)
-    except Score.DoesNotExist:
-      score = Score(user_id=request.user.id,
-                    video_id=video.id,
-                    video_owner_id=video.user.id,
-                    score_type=ScoreType.REVIEW_VIDEO,
-                    value=ScoreValue.REVIEW_VIDEO,
-                    created_time=int(time.time()))
-    score.save()
 
-    action = VideoStatus.APPROVED if action == 'approve' else VideoStatus.REJECTED
-    update_video_and_gloss_by_review(video, action)
+class ReviewBatchView(views.APIView):
+  def post(self, request):
+    """
+Review several videos at once.
 
-    # owner's video quality score
+post:
+  {
+    "reviews": [{"uuid": "c212f20c-5734-4e27-880c-e5469164dd7d",
+                 "action": "approve|reject"}, ...]
+  }
+  return a result per review, in order, with code 0 and the video score on
+  success or an error code and message, followed by the user scores.
+"""
     try:
-      score = Score.objects.get(user_id=request.user.id, video_id=video.id,
-                                score_type=ScoreType.VIDEO_QUALITY)
-    except Score.DoesNotExist:
-      score = Score(user_id=request.user.id,
-                    video_id=video.id,
-                    video_owner_id=video.user.id,
-                    score_type=ScoreType.VIDEO_QUALITY,
-                    value=ScoreValue.APPROVE_VIDEO if action == 'approved' else ScoreValue.REJECT_VIDEO,
-                    created_time=int(time.time()))
-    score.save()
+      reviews = [(review['uuid'], review['action'])
+                 for review in request.data['reviews']]
+    except (KeyError, TypeError):
+      return Response(build_resp(code=6701, message=_('Parameters error')))
 
-    video_score = services.get_video_score(video.id)
+    if not 0 < len(reviews) <= settings.REVIEW_BATCH_LIMIT or any(
+        type(uuid) != str or action not in ('approve', 'reject')
+        for uuid, action in reviews):
+      return Response(build_resp(code=6701, message=_('Parameters error')))
 
-    user_scores = services.get_user_scores(request.user.id)
+    results = services.review_videos(request.user.id, [
+      (uuid, VideoStatus.APPROVED if action == 'approve'
+       else VideoStatus.REJECTED) for uuid, action in reviews])
     data = {
-      'uuid': uuid,
-      'value': 1,
-      'video_score': video_score,
-      'user_scores': user_scores
+      'results': results,
+      'user_scores': services.get_user_scores(request.user.id)
     }
     return Response(build_resp(data))
 
 
+class ReviewTaskView(views.APIView):
+  def get(self, request):
+    """
+Hand out videos to review.
+
+The returned videos are leased to the user until expires_time, other
+reviewers get other videos meanwhile unless enough votes are missing.
+Asking again renews the leases and returns the leased videos first, for up
+to REVIEW_LEASE_MAX_SECONDS. Videos decided in the meantime are dropped.
+
+Example:
+  /api/review/tasks?limit=10
+"""
+    try:
+      limit = int(request.GET.get('limit', settings.PAGE_SIZE))
+    except ValueError:
+      limit = settings.PAGE_SIZE
+    limit = max(1, min(limit, settings.REVIEW_BATCH_LIMIT))
+
+    video_ids, expires_time = services.lease_review_tasks(request.user.id,
+                                                          limit)
+    videos = services.load_video_list(Video.objects).in_bulk(video_ids)
+    result = VideoSerializer([videos[id] for id in video_ids if id in videos],
+                             many=True).data
+    for item in result:
+      item['status'] = VideoStatus(item['status']).name
+    return Response(build_resp({
+      'expires_time': expires_time,
+      'data': result
+    }))
+
+
 class ProfileView(views.APIView):
   def get(self, request):
     data = {
@@ -520,20 +806,14 @@ BunchView provides recording tasks to users.
 """
 
   def _getUserPendingApprovalVideoCount(self, user):
-    qs = {'author': 'self', 'offset': [0], 'limit': [10000]}
-    data, next_offset, total = services.get_videos(user, qs, status=VideoStatus.PENDING_APPROVAL)
-    return 0 if data == None else total
+    return services.get_user_video_count(user.id,
+                                         VideoStatus.PENDING_APPROVAL)
 
   def _isReferenceCreator(self, user_id):
     return user_id == config.SAMPLE_VIDEO_USER_ID
 
-  def _getReferenceVideoBunch(self, user_id):
-    sql = '''SELECT g.* FROM cslt.cslt_gloss g
-        WHERE g.gloss_type <> 0 AND g.id NOT IN (
-          SELECT v.gloss_id FROM cslt.cslt_video v
-          WHERE v.user_id = %d) ORDER BY g.id;''' % (user_id)
-    glosses = list(Gloss.objects.raw(sql))
-    return glosses
+  def _getReferenceVideoBunch(self, user_id, cursor, limit):
+    return services.get_unrecorded_glosses(user_id, cursor, limit)
 
   def _getTrainingVideoBunch(self, request_user):
     # Check requested user's pending_approval video count. Do not assign more
@@ -543,44 +823,57 @@ BunchView provides recording tasks to users.
     if limit < 1:
       raise ValueError('Too many pending approval videos')
 
-    sql = '''SELECT g.* FROM cslt.cslt_gloss g
-        LEFT JOIN (
-          SELECT g.*, COUNT(v.id) AS count
-            FROM cslt.cslt_gloss g
-            JOIN cslt.cslt_video v ON v.gloss_id = g.id
-            WHERE v.user_id = %d AND v.status > 0
-            GROUP BY g.id) g2
-        ON g2.id = g.id WHERE g.gloss_type > 0 AND (
-           g.approved_video_count is NULL or g.approved_video_count < %d)
-        ORDER BY g.id
-        LIMIT %d;''' % (request_user.id, settings.DEFAULT_TARGET_TRAINING_VIDEO_COUNT_PER_GLOSS, limit)
-
-    glosses = list(Gloss.objects.raw(sql))
-
-    glosses_map = {k.id: k for v, k in enumerate(glosses)}
-
-    gloss_ids = Video.objects.filter(gloss_id__in=[gloss.id for gloss in glosses], user_id=request_user.id).values(
-      'gloss_id').annotate(video_count=Count('gloss_id'))
-
-    for item in gloss_ids:
-      if item['video_count'] > config.ONE_GLOSS_RECORDING_LIMIT:
-        glosses_map.pop(item['gloss_id'])
-
-    if gloss_ids:
-      glosses = glosses_map.values()
+    gloss_ids = recording_allocator.allocate(request_user.id, limit)
+    glosses = Gloss.objects.prefetch_related(
+      'sample_video__user', 'sample_video__gloss', 'categories').in_bulk(
+      gloss_ids)
+    glosses = [glosses[id] for id in gloss_ids if id in glosses]
 
     # Insert reference video place holder if it does not exist.
     for gloss in glosses:
-      if not gloss.sample_video.thumbnail:
+      if gloss.sample_video_id and not gloss.sample_video.thumbnail:
         gloss.sample_video.thumbnail = config.NO_PIC_URL
 
     return glosses
 
   def get(self, request):
+    """
+Get recording tasks.
+
+The reference recording user gets all the glosses without reference video,
+in gloss id order, or a page of them if either parameter is given:
+    * limit ( the page maximum length, from 1 to MAX_PAGE_SIZE, defaults to
+              REFERENCE_BUNCH_PAGE_SIZE )
+    * cursor ( pass an empty value for the first page and the returned
+               next_cursor for the following pages, the data is then
+               wrapped with next_cursor )
+
+Example:
+  /api/bunch/
+  /api/bunch/?cursor=&limit=20
+"""
     user_id = request.user.id
 
     if self._isReferenceCreator(user_id):
-      glosses = self._getReferenceVideoBunch(user_id)
+      qs = request.GET
+      try:
+        limit = None
+        # Clients that do not page get the whole list, as they used to.
+        if 'cursor' in qs or 'limit' in qs:
+          limit = int(qs.get('limit', settings.REFERENCE_BUNCH_PAGE_SIZE))
+          if not 0 < limit <= settings.MAX_PAGE_SIZE:
+            raise ValueError('Invalid limit')
+        glosses, next_cursor = self._getReferenceVideoBunch(
+          user_id, qs.get('cursor'), limit)
+      except ValueError:
+        return Response(build_resp(code=6701, message=_('Parameters error')))
+
+      if 'cursor' in qs:
+        gs = GlossSerializer(glosses, many=True)
+        return Response(build_resp({
+          'next_cursor': next_cursor,
+          'data': gs.data
+        }))
     else:
       try:
         glosses = self._getTrainingVideoBunch(request.user)
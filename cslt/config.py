@@ -20,6 +20,8 @@ ONE_GLOSS_RECORDING_LIMIT = int(os.getenv('ONE_GLOSS_RECORDING_LIMIT', ENV.ONE_G
 STATIC_URL = ENV.STATIC_URL
 MEDIA_ROOT = ENV.MEDIA_ROOT
 MEDIA_URL = ENV.MEDIA_URL
+MEDIA_ACCEL_REDIRECT = os.getenv(
+  'CSLT_MEDIA_ACCEL_REDIRECT', str(ENV.MEDIA_ACCEL_REDIRECT)).lower() == 'true'
 SIMPLE_JWT_ACCESS_TOKEN_LIFETIME = ENV.SIMPLE_JWT_ACCESS_TOKEN_LIFETIME
 SIMPLE_JWT_REFRESH_TOKEN_LIFETIME = ENV.SIMPLE_JWT_REFRESH_TOKEN_LIFETIME
 SIMPLE_JWT_SLIDING_TOKEN_LIFETIME = ENV.SIMPLE_JWT_SLIDING_TOKEN_LIFETIME
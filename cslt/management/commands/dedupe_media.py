@@ -0,0 +1,84 @@
+import hashlib
+import os.path
+import time
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cslt import settings, uploads
+from cslt.models import Video, MediaBlob
+
+
+def hash_file(name):
+  sha256 = hashlib.sha256()
+  with default_storage.open(name) as f:
+    for data in iter(lambda: f.read(1024 * 1024), b''):
+      sha256.update(data)
+  return sha256.hexdigest()
+
+
+class Command(BaseCommand):
+  help = ('Share one stored file between the videos of identical content, '
+          'delete the other copies and report the space saved.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report duplicates, do not change anything.')
+
+  def handle(self, *args, **options):
+    # Content of each stored video file, from the database when known.
+    contents = {}
+    names = defaultdict(list)
+    videos = Video.objects.exclude(video_path__isnull=True).exclude(
+      video_path='').values_list('id', 'video_path', 'sha256')
+    for id, video_path, sha256 in videos.iterator():
+      name = uploads.storage_name(video_path)
+      names[name].append(id)
+      if name not in contents:
+        try:
+          contents[name] = sha256 or hash_file(name)
+        except OSError as e:
+          self.stdout.write('video {}: {}'.format(id, e))
+
+    groups = defaultdict(list)
+    for name, sha256 in contents.items():
+      groups[sha256].append(name)
+
+    duplicates = saved = 0
+    for sha256, group in groups.items():
+      blob = MediaBlob.objects.filter(sha256=sha256).first()
+      # Keep the registered file, or the file of the most videos.
+      group.sort(key=lambda name: (blob is None or name != blob.name,
+                                   -len(names[name]), name))
+      kept, copies = group[0], group[1:]
+      for name in copies:
+        size = default_storage.size(name)
+        duplicates += 1
+        saved += size
+        self.stdout.write('{} duplicates {} ({} bytes, {} videos)'.format(
+          name, kept, size, len(names[name])))
+      if options['dry_run']:
+        continue
+
+      with transaction.atomic():
+        if copies:
+          Video.objects.filter(
+            id__in=[id for name in copies for id in names[name]]).update(
+            video_path=os.path.join(settings.MEDIA_URL, kept))
+        Video.objects.filter(
+          id__in=[id for name in group for id in names[name]]).update(
+          sha256=sha256)
+        MediaBlob.objects.update_or_create(sha256=sha256, defaults={
+          'name': kept,
+          'size': default_storage.size(kept),
+          'ref_count': sum(len(names[name]) for name in group),
+          'created_time': blob.created_time if blob else int(time.time()),
+        })
+        for name in copies:
+          transaction.on_commit(
+            lambda name=name: default_storage.delete(name))
+
+    self.stdout.write('{} duplicate files, {} bytes {}'.format(
+      duplicates, saved, 'to save' if options['dry_run'] else 'saved'))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from cslt import mp4, uploads
+from cslt.models import Video, ProcessingStatus
+
+
+class Command(BaseCommand):
+  help = ('Read the duration, picture size and frame rate of the uploaded '
+          'videos from their mp4 headers.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('--all', action='store_true',
+                        help='Probe the videos already probed too.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report invalid videos, do not save.')
+
+  def handle(self, *args, **options):
+    videos = Video.objects.exclude(video_path__isnull=True).exclude(
+      video_path='')
+    if not options['all']:
+      videos = videos.filter(duration__isnull=True)
+
+    probed = invalid = 0
+    for id, video_path in videos.values_list('id', 'video_path').iterator():
+      try:
+        with uploads.open_header(uploads.storage_name(video_path)) as f:
+          metadata = mp4.probe_file(f)
+        uploads.check_metadata(metadata)
+      except (mp4.InvalidMp4, OSError) as e:
+        invalid += 1
+        self.stdout.write('video {}: {}'.format(id, e))
+        if not options['dry_run']:
+          Video.objects.filter(id=id).update(
+            processing_status=ProcessingStatus.INVALID,
+            processing_error='probe: {}'.format(e)[:255])
+        continue
+
+      probed += 1
+      if not options['dry_run']:
+        Video.objects.filter(id=id).update(
+          **{field: metadata[field] for field in uploads.METADATA_FIELDS})
+
+    self.stdout.write('{} videos probed, {} invalid{}'.format(
+      probed, invalid, ' (dry run)' if options['dry_run'] else ''))
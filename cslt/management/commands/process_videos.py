@@ -0,0 +1,42 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from cslt import processing
+from cslt.models import Video, ProcessingStatus
+
+
+class Command(BaseCommand):
+  help = 'Process the uploaded videos whose processing is pending.'
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      '--retry-failed', action='store_true',
+      help='Also process the videos whose processing failed.')
+    parser.add_argument(
+      '--reset-running', action='store_true',
+      help='Also process the videos left running, e.g. by a killed server. '
+           'Only use it while no server processes videos.')
+
+  def handle(self, *args, **options):
+    statuses = [ProcessingStatus.PENDING]
+    if options['retry_failed']:
+      statuses.append(ProcessingStatus.FAILED)
+    if options['reset_running']:
+      statuses.append(ProcessingStatus.RUNNING)
+
+    video_ids = list(Video.objects.filter(
+      processing_status__in=statuses).values_list('id', flat=True))
+    futures = [processing.submit(video_id, statuses) for video_id in video_ids]
+
+    results = Counter()
+    for video_id, future in zip(video_ids, futures):
+      status = future.result()
+      if status is None:
+        continue
+      results[status] += 1
+      if status != ProcessingStatus.DONE:
+        self.stdout.write('video {}: {}'.format(video_id, status.name))
+    self.stdout.write('{} videos processed: {} done, {} failed, {} invalid'.format(
+      sum(results.values()), results[ProcessingStatus.DONE],
+      results[ProcessingStatus.FAILED], results[ProcessingStatus.INVALID]))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from cslt import settings, uploads
+
+
+class Command(BaseCommand):
+  help = 'Delete the resumable uploads that were never finalized.'
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      '--max-age', type=int, default=settings.UPLOAD_SESSION_MAX_AGE,
+      help='Age in seconds above which an unfinished upload is deleted.')
+
+  def handle(self, *args, **options):
+    count = uploads.purge_sessions(options['max_age'])
+    self.stdout.write('{} upload sessions purged'.format(count))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from cslt import services
+
+
+class Command(BaseCommand):
+  help = 'Rebuild the category closure table from the category tree.'
+
+  def handle(self, *args, **options):
+    count = services.rebuild_category_closure()
+    self.stdout.write('{} category closure rows'.format(count))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cslt.models import ReviewQueue, Video, VideoStatus
+
+
+class Command(BaseCommand):
+  help = 'Rebuild the review queue from the videos pending approval.'
+
+  def handle(self, *args, **options):
+    videos = Video.objects.filter(
+      status=VideoStatus.PENDING_APPROVAL).values_list(
+      'id', 'user_id', 'created_time', 'review_summary')
+
+    with transaction.atomic():
+      ReviewQueue.objects.all().delete()
+      ReviewQueue.objects.bulk_create(
+        [ReviewQueue(video_id=id, user_id=user_id, created_time=created_time,
+                     approved_count=(summary or {}).get('approved', 0),
+                     rejected_count=(summary or {}).get('rejected', 0))
+         for id, user_id, created_time, summary in videos.iterator()],
+        batch_size=1000)
+
+    self.stdout.write('{} videos queued for review'.format(
+      ReviewQueue.objects.count()))
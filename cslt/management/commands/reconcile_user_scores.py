@@ -0,0 +1,31 @@
+from cslt import services
+from cslt.management.reconcile import ReconcileCommand
+from cslt.models import UserScore
+
+
+class Command(ReconcileCommand):
+  help = 'Rebuild the user score ledger from the raw scores and report drift.'
+  target = 'the ledger'
+  noun = 'ledger rows'
+  empty = (0, 0)
+
+  def lock_rows(self, options):
+    return {(user_id, score_type): (total, count)
+            for user_id, score_type, total, count in
+            UserScore.objects.select_for_update().values_list(
+              'user_id', 'score_type', 'total', 'count')}
+
+  def compute(self, options):
+    return services.compute_user_scores()
+
+  def describe(self, key, stored, expected):
+    return 'user {} score type {}: ledger {}/{}, scores {}/{}'.format(
+      key[0], key[1], stored[0], stored[1], expected[0], expected[1])
+
+  def fix(self, key, expected, exists):
+    if exists:
+      UserScore.objects.filter(user_id=key[0], score_type=key[1]).update(
+        total=expected[0], count=expected[1])
+    else:
+      UserScore.objects.create(user_id=key[0], score_type=key[1],
+                               total=expected[0], count=expected[1])
@@ -0,0 +1,28 @@
+from cslt import services
+from cslt.management.reconcile import ReconcileCommand
+from cslt.models import UserVideoCount
+
+
+class Command(ReconcileCommand):
+  help = ('Recount the videos of every user by status and report drift. '
+          'Meant to run periodically.')
+
+  def lock_rows(self, options):
+    return {(user_id, status): count for user_id, status, count in
+            UserVideoCount.objects.select_for_update().values_list(
+              'user_id', 'status', 'count')}
+
+  def compute(self, options):
+    return services.compute_user_video_counts()
+
+  def describe(self, key, stored, expected):
+    return 'user {} status {}: counter {}, videos {}'.format(
+      key[0], key[1], stored, expected)
+
+  def fix(self, key, expected, exists):
+    if exists:
+      UserVideoCount.objects.filter(user_id=key[0], status=key[1]).update(
+        count=expected)
+    else:
+      UserVideoCount.objects.create(user_id=key[0], status=key[1],
+                                    count=expected)
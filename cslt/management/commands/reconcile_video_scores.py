@@ -0,0 +1,38 @@
+from django.db.models import Q
+
+from cslt import services
+from cslt.management.reconcile import ReconcileCommand
+from cslt.models import Video, Score, ScoreType
+
+
+class Command(ReconcileCommand):
+  help = ('Recompute the quality score stored with each video from the raw '
+          'scores and report drift.')
+  target = 'the videos'
+  noun = 'videos'
+  empty = (0, 0)
+
+  def lock_rows(self, options):
+    scored = Score.objects.filter(
+      score_type=ScoreType.VIDEO_QUALITY).values('video_id')
+    return {id: (quality_score, quality_count)
+            for id, quality_score, quality_count in
+            Video.objects.select_for_update().filter(
+              Q(id__in=scored) | ~Q(quality_count=0)).values_list(
+              'id', 'quality_score', 'quality_count')}
+
+  def compute(self, options):
+    return services.compute_video_scores()
+
+  def keys(self, stored, expected):
+    # Videos first scored once the lock was taken are left out, their scores
+    # and stored values were written together.
+    return sorted(stored)
+
+  def describe(self, key, stored, expected):
+    return 'video {}: stored {}/{}, scores {}/{}'.format(
+      key, stored[0], stored[1], expected[0], expected[1])
+
+  def fix(self, key, expected, exists):
+    Video.objects.filter(id=key).update(quality_score=expected[0],
+                                        quality_count=expected[1])
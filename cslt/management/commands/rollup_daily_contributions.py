@@ -0,0 +1,49 @@
+import datetime
+
+from cslt import services
+from cslt.management.reconcile import ReconcileCommand
+from cslt.models import DailyContribution
+
+
+class Command(ReconcileCommand):
+  help = ('Recount the daily contribution rollup from the videos and report '
+          'drift. Without --days, the whole history is backfilled; with it, '
+          'the command is meant to run periodically to catch up.')
+  target = 'the rollup'
+  noun = 'rollup rows'
+
+  def add_arguments(self, parser):
+    super(Command, self).add_arguments(parser)
+    parser.add_argument('--days', type=int,
+                        help='Only recount the videos created in the last '
+                             'DAYS days (UTC).')
+
+  def handle(self, *args, **options):
+    options['since'] = None
+    if options['days'] is not None:
+      options['since'] = datetime.datetime.utcnow().date() - \
+                         datetime.timedelta(days=options['days'])
+    super(Command, self).handle(*args, **options)
+
+  def lock_rows(self, options):
+    rows = DailyContribution.objects.select_for_update()
+    if options['since'] is not None:
+      rows = rows.filter(date__gte=options['since'])
+    return {(date, user_id, status): count
+            for date, user_id, status, count in rows.values_list(
+              'date', 'user_id', 'status', 'count')}
+
+  def compute(self, options):
+    return services.compute_daily_contributions(options['since'])
+
+  def describe(self, key, stored, expected):
+    return '{} user {} status {}: rollup {}, videos {}'.format(
+      key[0], key[1], key[2], stored, expected)
+
+  def fix(self, key, expected, exists):
+    if exists:
+      DailyContribution.objects.filter(
+        date=key[0], user_id=key[1], status=key[2]).update(count=expected)
+    else:
+      DailyContribution.objects.create(date=key[0], user_id=key[1],
+                                       status=key[2], count=expected)
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class ReconcileCommand(BaseCommand):
+  """
+  Base of the commands recomputing stored counters from the rows they are
+  derived from. Drifted counters are reported, then fixed unless --dry-run
+  is given.
+
+  The stored rows are locked before the expected values are computed. The
+  writers incrementing them wait for the lock, and the expected values are
+  read once it is held, so that increments committed in the meantime are not
+  overwritten with stale totals.
+
+  Subclasses set:
+    * target: what is fixed, e.g. 'the ledger'.
+    * noun: the counters in the summary line, e.g. 'ledger rows'.
+    * empty: the value of a missing counter.
+  and implement lock_rows, compute, describe and fix.
+  """
+  target = 'the counters'
+  noun = 'counters'
+  empty = 0
+
+  def add_arguments(self, parser):
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report drift, do not fix {}.'.format(
+                          self.target))
+
+  def lock_rows(self, options):
+    """Lock the stored counters, return their values by key."""
+    raise NotImplementedError
+
+  def compute(self, options):
+    """Return the expected counter values by key."""
+    raise NotImplementedError
+
+  def keys(self, stored, expected):
+    """List the keys of the counters to check, in order."""
+    return sorted(set(stored) | set(expected))
+
+  def describe(self, key, stored, expected):
+    """Return the report line of a drifted counter."""
+    raise NotImplementedError
+
+  def fix(self, key, expected, exists):
+    """Store the expected value of a drifted counter."""
+    raise NotImplementedError
+
+  def handle(self, *args, **options):
+    with transaction.atomic():
+      stored = self.lock_rows(options)
+      expected = self.compute(options)
+
+      drift = 0
+      for key in self.keys(stored, expected):
+        value = expected.get(key, self.empty)
+        if stored.get(key, self.empty) == value:
+          continue
+
+        drift += 1
+        self.stdout.write(
+          self.describe(key, stored.get(key, self.empty), value))
+        if not options['dry_run']:
+          self.fix(key, value, key in stored)
+
+    self.stdout.write('{} drifted {}{}'.format(
+      drift, self.noun, '' if options['dry_run'] else ' fixed'))
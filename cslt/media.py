@@ -0,0 +1,125 @@
+"""
+Serving of media files to authenticated users.
+
+Behind nginx (config.MEDIA_ACCEL_REDIRECT), the response only carries an
+X-Accel-Redirect header and nginx sends the file. Otherwise the file is sent
+by the app: conditional GETs are answered from an ETag built from the file
+size and modification time, single byte ranges are served with 206 Partial
+Content, and whole files go through FileResponse, which lets the WSGI server
+use sendfile.
+
+Thumbnails requested with a width are replaced by their resized variant.
+"""
+import mimetypes
+import re
+
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, \
+  StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from cslt import config, thumbnails
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOCK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+  """
+  Parse a Range header for a file of size bytes.
+
+  :return: the (start, end) offsets of the single range requested, end
+    excluded, or None to send the whole file.
+  :raise ValueError: if the range cannot be satisfied.
+  """
+  match = RANGE_RE.match(header.strip()) if header else None
+  if match is None:
+    # Missing, malformed and multiple ranges get the whole file.
+    return None
+  first, last = match.groups()
+  if not first:
+    if not last:
+      return None
+    # A suffix range, the last bytes of the file.
+    start, end = max(0, size - int(last)), size
+  else:
+    start = int(first)
+    end = min(size, int(last) + 1) if last else size
+  if start >= end:
+    raise ValueError('Unsatisfiable range')
+  return start, end
+
+
+def _read_range(f, start, end):
+  try:
+    f.seek(start)
+    while start < end:
+      data = f.read(min(BLOCK_SIZE, end - start))
+      if not data:
+        break
+      start += len(data)
+      yield data
+  finally:
+    f.close()
+
+
+def serve(request, path):
+  """
+  Return the response sending the media file at path. For images, a 'w'
+  query parameter selects a resized variant, see cslt.thumbnails.
+  """
+  try:
+    width = int(request.GET.get('w', 0))
+  except ValueError:
+    width = 0
+  if width > 0:
+    path = thumbnails.get_variant(path, width)
+
+  filename = path.split('/')[-1]
+  if config.MEDIA_ACCEL_REDIRECT:
+    response = HttpResponse()
+    response['Content-Disposition'] = 'attachment; filename={0}'.format(
+      filename)
+    response['X-Accel-Redirect'] = '/media/{0}'.format(path)
+    return response
+
+  try:
+    size = default_storage.size(path)
+    modified_time = default_storage.get_modified_time(path).timestamp()
+  except (OSError, NotImplementedError):
+    raise Http404
+  etag = quote_etag('{:x}-{:x}'.format(int(modified_time), size))
+
+  response = get_conditional_response(request, etag=etag,
+                                      last_modified=int(modified_time))
+  if response is not None:
+    return response
+
+  byte_range = None
+  if request.META.get('HTTP_IF_RANGE', etag) == etag:
+    try:
+      byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+      response = HttpResponse(status=416)
+      response['Content-Range'] = 'bytes */{}'.format(size)
+      return response
+
+  f = default_storage.open(path)
+  if byte_range is None:
+    response = FileResponse(f)
+    response['Content-Length'] = size
+  else:
+    start, end = byte_range
+    response = StreamingHttpResponse(_read_range(f, start, end), status=206)
+    response['Content-Length'] = end - start
+    response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end - 1, size)
+
+  response['Content-Type'] = mimetypes.guess_type(filename)[0] or \
+                             'application/octet-stream'
+  response['Content-Disposition'] = 'attachment; filename={0}'.format(
+    filename)
+  response['Accept-Ranges'] = 'bytes'
+  response['ETag'] = etag
+  response['Last-Modified'] = http_date(modified_time)
+  return response
@@ -16,6 +16,14 @@ class VideoStatus(CsltEnum):
   APPROVED = 7
 
 
+class ProcessingStatus(CsltEnum):
+  PENDING = 0
+  RUNNING = 1
+  DONE = 2
+  FAILED = 3
+  INVALID = 4
+
+
 class ScoreType(CsltEnum):
   REVIEW_VIDEO = 1
   CREATE_VIDEO = 2
@@ -63,6 +71,23 @@ class Category(models.Model):
     return ' / '.join(full_path[::-1])
 
 
+class CategoryClosure(models.Model):
+  """
+  Every (ancestor, descendant) pair of the category tree, including each
+  category paired with itself at depth 0.
+  """
+  ancestor = models.ForeignKey(Category, related_name='descendant_links',
+                               on_delete=models.CASCADE)
+  descendant = models.ForeignKey(Category, related_name='ancestor_links',
+                                 on_delete=models.CASCADE)
+  depth = models.IntegerField()
+
+  class Meta:
+    managed = False
+    db_table = 'cslt_category_closure'
+    unique_together = ('ancestor', 'descendant')
+
+
 class Gloss(models.Model):
   text = models.CharField(max_length=45, blank=True, null=False)
   gloss_type = models.IntegerField(
@@ -76,7 +101,8 @@ class Gloss(models.Model):
   approved_video_count = models.IntegerField(blank=True, null=True)
 
   sample_video = models.ForeignKey('Video', related_name='sample_video',
-                                   on_delete=models.SET_DEFAULT, default=None)
+                                   on_delete=models.SET_DEFAULT, default=None,
+                                   blank=True, null=True)
   created_time = models.IntegerField(blank=True)
 
   duration = models.IntegerField()
@@ -103,6 +129,20 @@ class Video(models.Model):
   thumbnail = models.FileField(max_length=255, blank=True, null=True)
   status = models.IntegerField(
       choices=[(status, status.value) for status in VideoStatus])
+  # Sum and count of the VIDEO_QUALITY scores of the video.
+  quality_score = models.IntegerField(default=0)
+  quality_count = models.IntegerField(default=0)
+  # Background processing of the uploaded file, see cslt.processing.
+  processing_status = models.IntegerField(
+      blank=True, null=True,
+      choices=[(status, status.value) for status in ProcessingStatus])
+  processing_attempts = models.IntegerField(default=0)
+  processing_error = models.CharField(max_length=255, blank=True, default='')
+  duration = models.FloatField(blank=True, null=True)
+  width = models.IntegerField(blank=True, null=True)
+  height = models.IntegerField(blank=True, null=True)
+  fps = models.FloatField(blank=True, null=True)
+  sha256 = models.CharField(max_length=64, blank=True, null=True)
 
   def __str__(self):
     return '{} | {}'.format(self.gloss.text, self.user.username)
@@ -128,3 +168,125 @@ class Score(models.Model):
   class Meta:
     managed = False
     db_table = 'cslt_score'
+
+
+class ReviewQueue(models.Model):
+  """
+  Videos waiting for reviews, i.e. the videos in PENDING_APPROVAL status.
+
+  Owner and created time are copied from the video so that reviewers read
+  their next videos from this table's index only.
+  """
+  video = models.OneToOneField(Video, primary_key=True,
+                               related_name='review_queue',
+                               on_delete=models.CASCADE)
+  user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+  created_time = models.IntegerField()
+  # Copies of the review_summary votes of the video.
+  approved_count = models.IntegerField(default=0)
+  rejected_count = models.IntegerField(default=0)
+
+  class Meta:
+    managed = False
+    db_table = 'cslt_review_queue'
+
+
+class ReviewLease(models.Model):
+  """
+  A queued video handed out to a reviewer at leased_time, until expires_time.
+  """
+  video = models.ForeignKey(Video, related_name='review_leases',
+                            on_delete=models.CASCADE)
+  user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+  leased_time = models.IntegerField()
+  expires_time = models.IntegerField()
+
+  class Meta:
+    managed = False
+    db_table = 'cslt_review_lease'
+    unique_together = ('video', 'user')
+
+
+class DailyContribution(models.Model):
+  """
+  Number of videos of a user in each video status, by the UTC date the
+  videos were created on.
+  """
+  date = models.DateField()
+  user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+  status = models.IntegerField(
+      choices=[(status, status.value) for status in VideoStatus])
+  count = models.IntegerField(default=0)
+
+  class Meta:
+    managed = False
+    db_table = 'cslt_daily_contribution'
+    unique_together = ('date', 'user', 'status')
+
+
+class MediaBlob(models.Model):
+  """
+  An uploaded video file, by the sha256 of its content. Videos uploading the
+  same content share the file, ref_count counts the videos referencing it.
+  source_sha256 is the content of the upload the file was made faststart
+  from, if any.
+  """
+  sha256 = models.CharField(max_length=64, unique=True)
+  source_sha256 = models.CharField(max_length=64, blank=True, null=True,
+                                   db_index=True)
+  name = models.CharField(max_length=255, unique=True)
+  size = models.BigIntegerField()
+  ref_count = models.IntegerField(default=0)
+  created_time = models.IntegerField()
+
+  class Meta:
+    managed = False
+    db_table = 'cslt_media_blob'
+
+
+class ThumbnailVariant(models.Model):
+  """
+  A resized copy of a video thumbnail, stored next to it. accessed_time is
+  refreshed at most every settings.THUMBNAIL_ACCESS_RESOLUTION seconds and
+  orders the eviction of the least recently used variants.
+  """
+  name = models.CharField(max_length=255, unique=True)
+  source = models.CharField(max_length=255)
+  width = models.IntegerField()
+  size = models.IntegerField()
+  accessed_time = models.IntegerField(db_index=True)
+
+  class Meta:
+    managed = False
+    db_table = 'cslt_thumbnail_variant'
+
+
+class UserScore(models.Model):
+  """
+  Running sum and count of the scores credited to a user, per score type.
+
+  Video quality scores are credited to the video owner, the other scores to
+  the scoring user. Scores of videos whose gloss type is 0 are not counted.
+  """
+  user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+  score_type = models.IntegerField()
+  total = models.IntegerField(default=0)
+  count = models.IntegerField(default=0)
+
+  class Meta:
+    managed = False
+    db_table = 'cslt_user_score'
+    unique_together = ('user', 'score_type')
+
+
+class UserVideoCount(models.Model):
+  """Number of videos of a user in each video status."""
+  user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+  status = models.IntegerField(
+      choices=[(status, status.value) for status in VideoStatus])
+  count = models.IntegerField(default=0)
+
+  class Meta:
+    managed = False
+    db_table = 'cslt_user_video_count'
+    unique_together = ('user', 'status')
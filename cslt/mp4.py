@@ -0,0 +1,250 @@
+"""
+Minimal reader of the ISO base media (mp4) container.
+
+Only box headers and the small boxes of the movie header are read, the media
+data is never loaded, so files are read through seek() and short read()s.
+"""
+import struct
+
+# Boxes whose payload is a list of boxes, down to the sample tables.
+CONTAINER_BOXES = {'moov', 'trak', 'mdia', 'minf', 'stbl', 'edts', 'dinf'}
+
+# Largest movie box loaded in memory to rewrite its chunk offsets.
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class InvalidMp4(ValueError):
+  """The file is not a well formed mp4 file."""
+
+
+def file_size(f):
+  f.seek(0, 2)
+  return f.tell()
+
+
+def iter_boxes(f, start, end):
+  """
+  Yield the (type, start, payload start, end) offsets of the boxes stored
+  between the start and end offsets of f.
+  """
+  offset = start
+  while offset < end:
+    f.seek(offset)
+    header = f.read(8)
+    if len(header) < 8:
+      raise InvalidMp4('Truncated box header at {}'.format(offset))
+    size, box_type = struct.unpack('>I4s', header)
+    header_size = 8
+    if size == 1:
+      large = f.read(8)
+      if len(large) < 8:
+        raise InvalidMp4('Truncated box header at {}'.format(offset))
+      size = struct.unpack('>Q', large)[0]
+      header_size = 16
+    elif size == 0:
+      size = end - offset
+    if size < header_size or offset + size > end:
+      raise InvalidMp4('Invalid size of box at {}'.format(offset))
+    yield box_type.decode('latin-1'), offset, offset + header_size, \
+        offset + size
+    offset += size
+
+
+def read_boxes(f):
+  """
+  List the top level boxes of an mp4 file.
+
+  :raise InvalidMp4: if the file does not start with a file type box or
+    lacks the movie or media data box.
+  """
+  boxes = list(iter_boxes(f, 0, file_size(f)))
+  types = [box[0] for box in boxes]
+  if not types or types[0] != 'ftyp':
+    raise InvalidMp4('Missing file type box')
+  if 'moov' not in types:
+    raise InvalidMp4('Missing movie box')
+  if 'mdat' not in types:
+    raise InvalidMp4('Missing media data box')
+  return boxes
+
+
+def _find(f, start, end, box_type):
+  for box in iter_boxes(f, start, end):
+    if box[0] == box_type:
+      return box
+  return None
+
+
+def _read(f, offset, size):
+  f.seek(offset)
+  data = f.read(size)
+  if len(data) < size:
+    raise InvalidMp4('Truncated box at {}'.format(offset))
+  return data
+
+
+def _track(f, trak):
+  """Read the handler type, picture size and frame rate of a track box."""
+  tkhd = _find(f, trak[2], trak[3], 'tkhd')
+  mdia = _find(f, trak[2], trak[3], 'mdia')
+  if tkhd is None or mdia is None:
+    raise InvalidMp4('Missing track header or media box')
+
+  version = _read(f, tkhd[2], 1)[0]
+  # Fixed point 16.16 sizes after the matrix, zero for audio tracks.
+  width, height = struct.unpack(
+    '>II', _read(f, tkhd[2] + (88 if version == 1 else 76), 8))
+  track = {'handler': '', 'width': width >> 16, 'height': height >> 16,
+           'fps': None}
+
+  hdlr = _find(f, mdia[2], mdia[3], 'hdlr')
+  if hdlr is not None:
+    track['handler'] = _read(f, hdlr[2] + 8, 4).decode('latin-1')
+
+  mdhd = _find(f, mdia[2], mdia[3], 'mdhd')
+  minf = _find(f, mdia[2], mdia[3], 'minf')
+  stbl = minf and _find(f, minf[2], minf[3], 'stbl')
+  stts = stbl and _find(f, stbl[2], stbl[3], 'stts')
+  if mdhd is None or stts is None:
+    return track
+
+  version = _read(f, mdhd[2], 1)[0]
+  timescale = struct.unpack(
+    '>I', _read(f, mdhd[2] + (20 if version == 1 else 12), 4))[0]
+  # The time to sample table lists runs of samples of equal duration.
+  count = struct.unpack('>I', _read(f, stts[2] + 4, 4))[0]
+  if stts[2] + 8 + count * 8 > stts[3]:
+    raise InvalidMp4('Invalid time to sample box')
+  entries = struct.unpack('>{}I'.format(count * 2),
+                          _read(f, stts[2] + 8, count * 8))
+  samples = sum(entries[0::2])
+  duration = sum(c * d for c, d in zip(entries[0::2], entries[1::2]))
+  if timescale and duration:
+    track['fps'] = samples * timescale / duration
+  return track
+
+
+def probe(f, boxes):
+  """
+  Read the duration, picture size and frame rate of an mp4 file.
+
+  :param boxes: the top level boxes of the file, as returned by read_boxes.
+  :return: a dict of duration in seconds, width and height in pixels, fps,
+    None if unknown, and faststart, true if the movie box comes before the
+    media data.
+  :raise InvalidMp4: if the file has no video track.
+  """
+  types = [box[0] for box in boxes]
+  moov = boxes[types.index('moov')]
+
+  mvhd = _find(f, moov[2], moov[3], 'mvhd')
+  if mvhd is None:
+    raise InvalidMp4('Missing movie header box')
+  version = _read(f, mvhd[2], 1)[0]
+  if version == 1:
+    timescale, duration = struct.unpack('>IQ', _read(f, mvhd[2] + 20, 12))
+  else:
+    timescale, duration = struct.unpack('>II', _read(f, mvhd[2] + 12, 8))
+  if not timescale:
+    raise InvalidMp4('Invalid movie time scale')
+
+  video = None
+  for box in iter_boxes(f, moov[2], moov[3]):
+    if box[0] == 'trak':
+      track = _track(f, box)
+      # Files without handler boxes are told apart by their picture size.
+      if track['handler'] == 'vide' or (
+          not track['handler'] and track['width'] and video is None):
+        video = track
+        if track['handler'] == 'vide':
+          break
+  if video is None:
+    raise InvalidMp4('Missing video track')
+
+  return {
+    'duration': duration / timescale,
+    'width': video['width'],
+    'height': video['height'],
+    'fps': video['fps'],
+    'faststart': types.index('moov') < types.index('mdat'),
+  }
+
+
+def probe_file(f):
+  """Check the structure of an mp4 file and probe it, see probe."""
+  return probe(f, read_boxes(f))
+
+
+def _shift_chunk_offsets(moov, start, end, low, high, shift):
+  """
+  Add shift to the chunk offsets of the sample tables of moov, a bytearray
+  holding the movie box, that fall in [low, high).
+  """
+  offset = start
+  while offset < end:
+    size, box_type = struct.unpack_from('>I4s', moov, offset)
+    header_size = 8
+    if size == 1:
+      size = struct.unpack_from('>Q', moov, offset + 8)[0]
+      header_size = 16
+    elif size == 0:
+      size = end - offset
+    box_type = box_type.decode('latin-1')
+    payload = offset + header_size
+    if box_type in CONTAINER_BOXES:
+      _shift_chunk_offsets(moov, payload, offset + size, low, high, shift)
+    elif box_type in ('stco', 'co64'):
+      entry = '>I' if box_type == 'stco' else '>Q'
+      entry_size = struct.calcsize(entry)
+      count = struct.unpack_from('>I', moov, payload + 4)[0]
+      for i in range(count):
+        position = payload + 8 + i * entry_size
+        value = struct.unpack_from(entry, moov, position)[0]
+        if low <= value < high:
+          value += shift
+          if value >= 1 << (8 * entry_size):
+            raise InvalidMp4('Chunk offset overflow')
+          struct.pack_into(entry, moov, position, value)
+    offset += size
+
+
+def _copy(src, dst, start, end):
+  src.seek(start)
+  while start < end:
+    data = src.read(min(COPY_BUFFER_SIZE, end - start))
+    if not data:
+      raise InvalidMp4('Truncated file')
+    dst.write(data)
+    start += len(data)
+
+
+def write_faststart(src, dst, boxes):
+  """
+  Copy an mp4 file with its movie box moved right after the file type box,
+  so that players can start before the whole file is downloaded.
+
+  :param boxes: the top level boxes of src, as returned by read_boxes.
+  :return: False, with nothing written, if src is already faststart or its
+    movie box is too large to move.
+  """
+  types = [box[0] for box in boxes]
+  moov_box = boxes[types.index('moov')]
+  if types.index('moov') < types.index('mdat') or \
+      moov_box[3] - moov_box[1] > MAX_MOOV_SIZE:
+    return False
+
+  ftyp_end = boxes[0][3]
+  moov = bytearray(_read(src, moov_box[1], moov_box[3] - moov_box[1]))
+  # The data between the file type and movie boxes moves down by the size of
+  # the movie box, the data after it stays in place.
+  _shift_chunk_offsets(moov, moov_box[2] - moov_box[1], len(moov),
+                       ftyp_end, moov_box[1], len(moov))
+
+  _copy(src, dst, 0, ftyp_end)
+  dst.write(bytes(moov))
+  for box in boxes[1:]:
+    if box is not moov_box:
+      _copy(src, dst, box[1], box[3])
+  return True
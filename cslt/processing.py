@@ -0,0 +1,208 @@
+"""
+Background processing of uploaded videos.
+
+services.complete_upload only stores the upload and marks the video PENDING
+processing. Once the upload transaction commits, the video is handed to a
+pool of settings.VIDEO_PROCESSING_WORKERS threads, which run the STEPS over
+the uploaded file. Each step returns the Video fields it computed, which are
+saved right away. A step failing with an unexpected error is retried
+settings.VIDEO_PROCESSING_RETRIES times. The process_videos command picks up
+the videos left PENDING or FAILED, e.g. by a restarted server.
+"""
+import hashlib
+import logging
+import os.path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import F
+
+from cslt import mp4, settings, uploads
+from cslt.models import Video, ProcessingStatus
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def validate_container(video, context):
+  """Check the mp4 box structure of the file."""
+  context['boxes'] = mp4.read_boxes(context['file'])
+  return {}
+
+
+def extract_metadata(video, context):
+  """Read the duration, picture size and frame rate from the movie header."""
+  context['probe'] = mp4.probe(context['file'], context['boxes'])
+  uploads.check_metadata(context['probe'])
+  return {field: context['probe'][field]
+          for field in uploads.METADATA_FIELDS}
+
+
+def compute_checksum(video, context):
+  """Hash the file, unless the upload already did."""
+  if video.sha256:
+    return {}
+  sha256 = hashlib.sha256()
+  f = context['file']
+  f.seek(0)
+  for data in iter(lambda: f.read(mp4.COPY_BUFFER_SIZE), b''):
+    sha256.update(data)
+  return {'sha256': sha256.hexdigest()}
+
+
+def _write_faststart(name, f, boxes):
+  """
+  Write a copy of the stored mp4 file name, opened as f, with its movie box
+  first.
+
+  :return: the storage name and the sha256 of the copy, None if the file
+    needs no copy.
+  """
+  copy, destination = uploads.create_file(name)
+  try:
+    written = mp4.write_faststart(f, destination, boxes)
+  finally:
+    destination.close()
+  if not written:
+    default_storage.delete(copy)
+    return None
+
+  # The copy has the same bytes, moved, so the checksum is recomputed.
+  sha256 = hashlib.sha256()
+  with default_storage.open(copy) as f:
+    for data in iter(lambda: f.read(mp4.COPY_BUFFER_SIZE), b''):
+      sha256.update(data)
+  return copy, sha256.hexdigest()
+
+
+def make_faststart(video, context):
+  """
+  Replace a file whose movie box comes after the media data by a copy with
+  the movie box first, so that it can be played while it downloads.
+  """
+  if context['probe']['faststart']:
+    return {}
+
+  copy = _write_faststart(context['name'], context['file'], context['boxes'])
+  if copy is None:
+    return {}
+  name, sha256 = copy
+
+  with transaction.atomic():
+    # The blob keeps the former checksum, announced by clients uploading the
+    # same file again.
+    name = uploads.acquire_blob(sha256, name, video.sha256)
+    if not Video.objects.filter(
+        id=video.id, video_path=video.video_path.name).update(
+        video_path=os.path.join(settings.MEDIA_URL, name), sha256=sha256):
+      # The video was uploaded again meanwhile.
+      uploads.release_blob(name)
+      return {}
+    uploads.release_blob(context['name'])
+  context['name'] = name
+  return {}
+
+
+STEPS = (
+  ('validate', validate_container),
+  ('metadata', extract_metadata),
+  ('checksum', compute_checksum),
+  ('faststart', make_faststart),
+)
+
+
+def _finish(video_id, status, error=''):
+  Video.objects.filter(id=video_id).update(processing_status=status,
+                                           processing_error=error[:255])
+
+
+def process_video(video_id, statuses=(ProcessingStatus.PENDING,)):
+  """
+  Run the processing steps over the file of a video, if its processing
+  status is one of statuses.
+
+  :return: the final processing status, None if the video was not processed.
+  """
+  if not Video.objects.filter(id=video_id, processing_status__in=statuses) \
+      .update(processing_status=ProcessingStatus.RUNNING,
+              processing_attempts=F('processing_attempts') + 1):
+    return None
+
+  video = Video.objects.get(id=video_id)
+  context = {'name': uploads.storage_name(video.video_path.name)}
+  try:
+    context['file'] = default_storage.open(context['name'])
+  except Exception as e:
+    logger.warning('Cannot open video %s: %s', video_id, e)
+    _finish(video_id, ProcessingStatus.FAILED, 'open: {}'.format(e))
+    return ProcessingStatus.FAILED
+
+  try:
+    for name, step in STEPS:
+      for attempt in range(settings.VIDEO_PROCESSING_RETRIES + 1):
+        try:
+          fields = step(video, context)
+          break
+        except mp4.InvalidMp4 as e:
+          _finish(video_id, ProcessingStatus.INVALID, '{}: {}'.format(name, e))
+          return ProcessingStatus.INVALID
+        except Exception as e:
+          logger.warning('Video %s processing step %s failed: %s',
+                         video_id, name, e)
+          if attempt == settings.VIDEO_PROCESSING_RETRIES:
+            _finish(video_id, ProcessingStatus.FAILED,
+                    '{}: {}'.format(name, e))
+            return ProcessingStatus.FAILED
+          time.sleep(settings.VIDEO_PROCESSING_RETRY_DELAY * 2 ** attempt)
+      if fields:
+        Video.objects.filter(id=video_id).update(**fields)
+        for field, value in fields.items():
+          setattr(video, field, value)
+  finally:
+    context['file'].close()
+
+  _finish(video_id, ProcessingStatus.DONE)
+  return ProcessingStatus.DONE
+
+
+def _run(video_id, statuses):
+  try:
+    return process_video(video_id, statuses)
+  except Exception:
+    logger.exception('Video %s processing failed', video_id)
+  finally:
+    connections.close_all()
+
+
+def _get_executor():
+  global _executor
+  with _executor_lock:
+    if _executor is None:
+      _executor = ThreadPoolExecutor(max(1, settings.VIDEO_PROCESSING_WORKERS),
+                                     thread_name_prefix='video-processing')
+    return _executor
+
+
+def submit(video_id, statuses=(ProcessingStatus.PENDING,)):
+  """
+  Process a video on the worker pool.
+
+  :return: a Future of the final processing status.
+  """
+  return _get_executor().submit(_run, video_id, statuses)
+
+
+def schedule(video_id):
+  """
+  Process a video once the current transaction commits. With no workers
+  configured, the video is processed right away in the calling thread.
+  """
+  if settings.VIDEO_PROCESSING_WORKERS:
+    transaction.on_commit(lambda: submit(video_id))
+  else:
+    transaction.on_commit(lambda: process_video(video_id))
@@ -0,0 +1,146 @@
+"""
+In-process search index over gloss texts.
+
+Gloss searches used to run LIKE '%q%' scans on cslt_gloss. The index keeps
+the unigrams and bigrams of every gloss text and of its pinyin initials, so
+that a query is answered by intersecting a few posting sets and checking the
+remaining candidates.
+
+Matches are ranked, exact texts first, then texts and initials starting
+with the query, then shorter texts, and at most settings.GLOSS_SEARCH_MAX_RESULTS
+are returned, so that short queries do not send the whole dictionary back to
+the database.
+
+The index is built when the process starts, or on first use, and kept up to
+date by the Gloss signal handlers of this process. A background thread
+rebuilds it every settings.GLOSS_INDEX_REFRESH_INTERVAL seconds to pick up
+changes made by other processes.
+"""
+import bisect
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from cslt import settings
+from cslt.utils import BackgroundBuilt
+
+# The first GB2312 code of each pinyin initial. Level 1 Chinese characters
+# (0xB0A1 - 0xD7F9) are ordered by pinyin in GB2312, which GBK extends.
+_GB2312_INITIAL_CODES = [
+  0xB0A1, 0xB0C5, 0xB2C1, 0xB4EE, 0xB6EA, 0xB7A2, 0xB8C1, 0xB9FE, 0xBBF7,
+  0xBFA6, 0xC0AC, 0xC2E8, 0xC4C3, 0xC5B6, 0xC5BE, 0xC6DA, 0xC8BB, 0xC8F6,
+  0xCBFA, 0xCDDA, 0xCEF4, 0xD1B9, 0xD4D1]
+_GB2312_INITIALS = 'abcdefghjklmnopqrstwxyz'
+_GB2312_LEVEL1_END = 0xD7F9
+
+
+def pinyin_initials(text):
+  """
+  Return the pinyin initials of the Chinese characters of text, e.g. 'nh'
+  for '你好'. Other characters are dropped.
+  """
+  initials = []
+  for char in text:
+    try:
+      encoded = char.encode('gbk')
+    except UnicodeEncodeError:
+      continue
+    if len(encoded) != 2:
+      continue
+    code = encoded[0] << 8 | encoded[1]
+    if _GB2312_INITIAL_CODES[0] <= code <= _GB2312_LEVEL1_END:
+      initials.append(
+        _GB2312_INITIALS[bisect.bisect(_GB2312_INITIAL_CODES, code) - 1])
+  return ''.join(initials)
+
+
+def _grams(text):
+  return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class GlossIndex(BackgroundBuilt):
+  thread_name = 'gloss-index'
+
+  def __init__(self):
+    super(GlossIndex, self).__init__()
+    self._lock = threading.Lock()
+    self._keys = {}
+    self._postings = defaultdict(set)
+
+  def _add(self, id, text):
+    text = (text or '').lower()
+    keys = (text, pinyin_initials(text))
+    self._keys[id] = keys
+    for key in keys:
+      for gram in _grams(key):
+        self._postings[gram].add(id)
+
+  def _remove(self, id):
+    for key in self._keys.pop(id, ()):
+      for gram in _grams(key):
+        self._postings[gram].discard(id)
+
+  def build(self):
+    """Load every gloss text into a fresh index."""
+    from cslt.models import Gloss
+
+    index = GlossIndex()
+    for id, text in Gloss.objects.values_list('id', 'text').iterator():
+      index._add(id, text)
+    with self._lock:
+      self._keys, self._postings = index._keys, index._postings
+      self._built_time = time.time()
+
+  def refresh_interval(self):
+    return settings.GLOSS_INDEX_REFRESH_INTERVAL
+
+  def update(self, id, text):
+    """Index a new or changed gloss, a no-op until the index is built."""
+    with self._lock:
+      if self._built_time is not None:
+        self._remove(id)
+        self._add(id, text)
+
+  def remove(self, id):
+    with self._lock:
+      if self._built_time is not None:
+        self._remove(id)
+
+  def search(self, query, prefix=False):
+    """
+    Find the glosses whose text, or pinyin initials, contain query.
+
+    :param prefix: only match texts or initials starting with query.
+    :return: the ids of the best settings.GLOSS_SEARCH_MAX_RESULTS matches,
+      best first. Nothing for an empty query.
+    """
+    query = query.lower()
+    if not query:
+      return []
+    self.ensure_built()
+
+    with self._lock:
+      grams = _grams(query) if len(query) == 1 else {
+        query[i:i + 2] for i in range(len(query) - 1)}
+      candidates = set.intersection(
+        *[self._postings.get(gram, set()) for gram in grams])
+
+      matches = []
+      for id in candidates:
+        text, initials = self._keys[id]
+        starts = text.startswith(query) or initials.startswith(query)
+        if not starts and (prefix or (query not in text and
+                                      query not in initials)):
+          continue
+        matches.append((text != query, not starts, len(text), text, id))
+    return [match[-1] for match in heapq.nsmallest(
+      settings.GLOSS_SEARCH_MAX_RESULTS, matches)]
+
+
+gloss_index = GlossIndex()
+
+
+def search_glosses(query, prefix=False):
+  """Search gloss ids by text or pinyin initials, see GlossIndex.search."""
+  return gloss_index.search(query, prefix)
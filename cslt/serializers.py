@@ -27,12 +27,32 @@ class SimpleUserSerializer(serializers.Serializer):
   username = serializers.CharField()
 
 
+def thumbnail_variant_url(thumbnail):
+  """
+  The media api url of the list size variant of a thumbnail. Thumbnails
+  outside the media, e.g. config.NO_PIC_URL, are returned unchanged.
+  """
+  from cslt.uploads import storage_name
+
+  if not thumbnail:
+    return None
+  thumbnail = str(thumbnail)
+  if not thumbnail.startswith(settings.MEDIA_URL):
+    return thumbnail
+  return '/api/media/{}?w={}'.format(storage_name(thumbnail),
+                                     settings.THUMBNAIL_LIST_WIDTH)
+
+
 class SimpleVideoSerializer(serializers.Serializer):
   uuid = serializers.CharField(max_length=36)
   video_path = serializers.CharField()
   thumbnail = serializers.CharField()
+  thumbnail_small = serializers.SerializerMethodField()
   creator = SimpleUserSerializer(source='user')
 
+  def get_thumbnail_small(self, video):
+    return thumbnail_variant_url(video.thumbnail)
+
 
 class VideoSerializer(serializers.Serializer):
   id = serializers.IntegerField(write_only=True)
@@ -45,6 +65,12 @@ class VideoSerializer(serializers.Serializer):
   thumbnail = serializers.CharField()
   status = serializers.IntegerField()
   review_summary = serializers.DictField()
+  quality_score = serializers.IntegerField()
+  processing_status = serializers.IntegerField()
+  thumbnail_small = serializers.SerializerMethodField()
+
+  def get_thumbnail_small(self, video):
+    return thumbnail_variant_url(video.thumbnail)
 
 
 class VideoUploadSerializer(serializers.Serializer):
@@ -58,9 +84,10 @@ class VideoUploadSerializer(serializers.Serializer):
 
     if video.content_type != 'video/mp4':
       raise Exception('The uploaded file is not supported ' + video.content_type)
-    file_path = get_upload_url(video.name)
     try:
-      path = default_storage.save(file_path, video)
+      # Videos streamed to the storage by StorageUploadHandler are stored.
+      path = getattr(video, 'storage_name', None) or default_storage.save(
+        get_upload_url(video.name), video)
       path = os.path.join(settings.MEDIA_URL, path)
       self.validated_data['video'] = path
 
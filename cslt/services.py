@@ -1,65 +1,329 @@
+import base64
+import binascii
+import calendar
+import datetime
+import hashlib
+import json
+import os.path
 import time
 import uuid
+from collections import Counter, defaultdict
 
-from django.db.models import Q, Sum, Count
+from django.core.cache import cache
+from django.db.models import Q, F, Sum, Count, Value
+from django.db.models.functions import Coalesce, Least, Floor
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils.translation import ugettext_lazy as _
 
-from cslt import settings, config
-from cslt.models import Video, VideoStatus, ScoreType, Score, Gloss
+from cslt import settings, config, search, processing, uploads
+from cslt.allocator import recording_allocator
+from django.db import transaction, IntegrityError
+
+from cslt.models import Video, VideoStatus, ScoreType, Score, ScoreValue, \
+  Gloss, ReviewQueue, ReviewLease, Category, CategoryClosure, UserScore, \
+  UserVideoCount, ProcessingStatus, DailyContribution
 
 INITIAL_SUMMARY = {'approved': 0, 'rejected': 0}
 
+# Sort keys of video lists by order parameter, the last field must be unique.
+# Lists are sorted by descending keys.
+VIDEO_ORDERINGS = {
+  'latest': ('created_time', 'id'),
+  'quality': ('quality_score', 'created_time', 'id'),
+}
+
+# Columns read by VideoSerializer, including those of the related user and
+# gloss rows.
+VIDEO_LIST_FIELDS = ('id', 'uuid', 'created_time', 'video_path', 'thumbnail',
+                     'status', 'review_summary', 'quality_score',
+                     'processing_status', 'user', 'user__id',
+                     'user__username', 'gloss', 'gloss__id', 'gloss__text')
+
+
+def _count_generation_key(kind):
+  return 'count-generation:' + kind
+
+
+def invalidate_counts(*kinds):
+  """Drop the cached totals of the given kinds of list, e.g. 'videos'."""
+  for kind in kinds:
+    try:
+      cache.incr(_count_generation_key(kind))
+    except ValueError:
+      cache.set(_count_generation_key(kind), 1, None)
+
+
+def count_total(kind, params, queryset, mode='exact'):
+  """
+  Count the rows of a list queryset built from the filter params.
+
+  Exact totals are cached under the normalized params until a write
+  invalidates their kind or settings.COUNT_CACHE_TIMEOUT passes.
+
+  :param mode: 'exact' or 'approx'. An approximate total is the last total
+    counted for params even if it has been invalidated since, or None when
+    params have never been counted.
+  """
+  digest = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode(
+      )).hexdigest()
+  last_key = 'count:{}:{}'.format(kind, digest)
+  generation = cache.get(_count_generation_key(kind), 0)
+  key = '{}:{}'.format(last_key, generation)
+
+  total = cache.get(key)
+  if total is not None:
+    return total
+  if mode == 'approx':
+    return cache.get(last_key)
+
+  total = queryset.count()
+  cache.set(key, total, settings.COUNT_CACHE_TIMEOUT)
+  cache.set(last_key, total, None)
+  return total
+
+
+@receiver(post_save, sender=Gloss)
+def on_gloss_save(sender, instance, **kwargs):
+  invalidate_counts('glosses')
+  search.gloss_index.update(instance.id, instance.text)
+  recording_allocator.set_gloss(instance.id, int(instance.gloss_type),
+                                instance.approved_video_count,
+                                instance.pending_approval_video_count)
+
+
+@receiver(post_delete, sender=Gloss)
+def on_gloss_delete(sender, instance, **kwargs):
+  invalidate_counts('glosses')
+  search.gloss_index.remove(instance.id)
+  recording_allocator.set_gloss(instance.id, 0, 0, 0)
+
+
+def rebuild_category_closure():
+  """
+  Recompute the category closure table from cslt_category.
+
+  :return: the number of closure rows.
+  """
+  parents = dict(Category.objects.values_list('id', 'parent_id'))
+  rows = []
+  for id in parents:
+    ancestor, depth, seen = id, 0, set()
+    # Root categories have a parent id of 0 or NULL.
+    while ancestor in parents and ancestor not in seen:
+      seen.add(ancestor)
+      rows.append(CategoryClosure(ancestor_id=ancestor, descendant_id=id,
+                                  depth=depth))
+      ancestor, depth = parents[ancestor], depth + 1
+
+  with transaction.atomic():
+    CategoryClosure.objects.all().delete()
+    CategoryClosure.objects.bulk_create(rows, batch_size=1000)
+  return len(rows)
+
+
+def category_gloss_ids(category_ids):
+  """
+  Build the subquery of the ids of glosses in the given categories or in any
+  of their subcategories.
+  """
+  return Gloss.categories.through.objects.filter(
+      category__ancestor_links__ancestor_id__in=category_ids).values(
+      'gloss_id')
+
+
+@receiver(post_delete, sender=Video)
+def on_video_delete(sender, instance, **kwargs):
+  if instance.video_path:
+    uploads.release_blob(uploads.storage_name(instance.video_path.name))
+
+
+@receiver([post_save, post_delete], sender=Category)
+def on_category_change(sender, **kwargs):
+  rebuild_category_closure()
+  invalidate_counts('videos', 'glosses')
+
+
+@receiver(m2m_changed, sender=Gloss.categories.through)
+@receiver(m2m_changed, sender=Category.glosses.through)
+def on_gloss_categories_change(sender, action, **kwargs):
+  if action in ('post_add', 'post_remove', 'post_clear'):
+    invalidate_counts('videos', 'glosses')
+
 
 def create_videos(user, gloss_ids):
   """
   Create videos following gloss ids
 
   :param user: owner
-  :param gloss_ids: a list of gloss ids
+  :param gloss_ids: a list of gloss ids, ints or numeric strings
   :return: created videos uuids list or one uuid for single gloss.
+  :raise ValueError: if a gloss id is not the id of a gloss.
   """
-  uuids = []
-  for gloss_id in gloss_ids:
-    video = Video(
-        user_id=user.id,
-        gloss_id=gloss_id,
-        uuid=str(uuid.uuid4()),
-        review_summary=INITIAL_SUMMARY,
-        created_time=int(time.time()),
-        status=VideoStatus.WAITING_UPLOAD
-    )
-    video.save()
-    uuids.append(video.uuid)
-
+  if any(type(gloss_id) not in (int, str) for gloss_id in gloss_ids):
+    raise ValueError('Invalid gloss id')
+  gloss_ids = [int(gloss_id) for gloss_id in gloss_ids]
+  if len(set(gloss_ids)) != Gloss.objects.filter(
+      id__in=set(gloss_ids)).count():
+    raise ValueError('Unknown gloss id')
+
+  created_time = int(time.time())
+  videos = [Video(user_id=user.id,
+                  gloss_id=gloss_id,
+                  uuid=str(uuid.uuid4()),
+                  review_summary=dict(INITIAL_SUMMARY),
+                  created_time=created_time,
+                  status=VideoStatus.WAITING_UPLOAD)
+            for gloss_id in gloss_ids]
+  with transaction.atomic():
+    Video.objects.bulk_create(videos)
+    add_user_video_count(user.id, VideoStatus.WAITING_UPLOAD, len(videos))
+    add_daily_contribution(created_time, user.id, VideoStatus.WAITING_UPLOAD,
+                           len(videos))
+    transaction.on_commit(
+        lambda: recording_allocator.add_user_videos(user.id, gloss_ids))
+  invalidate_counts('videos')
+
+  uuids = [video.uuid for video in videos]
   if len(uuids) == 1:
     uuids = uuids[0]
 
   return uuids
 
 
+def add_user_video_count(user_id, status, count):
+  increment_row(UserVideoCount, {'user_id': user_id, 'status': int(status)},
+                count=count)
+
+
+def video_date(created_time):
+  """Return the UTC date of a video created_time."""
+  return datetime.datetime.utcfromtimestamp(created_time).date()
+
+
+def add_daily_contribution(created_time, user_id, status, count):
+  increment_row(DailyContribution, {'date': video_date(created_time),
+                                    'user_id': user_id,
+                                    'status': int(status)},
+                count=count)
+
+
+def compute_daily_contributions(since=None):
+  """
+  Count the videos of every user by creation date and status, as
+  DailyContribution should hold them.
+
+  :param since: only count the videos created on or after this date.
+  :return: a dict of counts keyed by (date, user id, status).
+  """
+  videos = Video.objects.all()
+  if since is not None:
+    videos = videos.filter(created_time__gte=calendar.timegm(
+      since.timetuple()))
+  return {(video_date(day * 86400), user_id, status): count
+          for day, user_id, status, count in videos.annotate(
+            day=Floor(F('created_time') / 86400)).values_list(
+            'day', 'user_id', 'status').annotate(
+            count=Count('id')).values_list(
+            'day', 'user_id', 'status', 'count').order_by()}
+
+
+def get_user_video_count(user_id, status):
+  """Return the number of videos of a user in status."""
+  count = UserVideoCount.objects.filter(
+      user_id=user_id, status=status).values_list('count', flat=True).first()
+  return count or 0
+
+
+def compute_user_video_counts():
+  """
+  Count the videos of every user by status, as UserVideoCount should hold
+  them.
+
+  :return: a dict of counts keyed by (user id, status).
+  """
+  return {(user_id, status): count for user_id, status, count in
+          Video.objects.values_list('user_id', 'status').annotate(
+            count=Count('id')).order_by()}
+
+
+def sync_video_status(video, old_status):
+  """
+  Update the data derived from video status after the video moved from
+  old_status to its current status.
+  """
+  old_status, new_status = int(old_status), int(video.status)
+  if old_status == new_status:
+    return
+
+  add_user_video_count(video.user_id, old_status, -1)
+  add_user_video_count(video.user_id, new_status, 1)
+  add_daily_contribution(video.created_time, video.user_id, old_status, -1)
+  add_daily_contribution(video.created_time, video.user_id, new_status, 1)
+
+  if new_status == VideoStatus.PENDING_APPROVAL.value:
+    ReviewQueue.objects.update_or_create(
+        video_id=video.id,
+        defaults={'user_id': video.user_id,
+                  'created_time': video.created_time})
+  elif old_status == VideoStatus.PENDING_APPROVAL.value:
+    ReviewQueue.objects.filter(video_id=video.id).delete()
+    ReviewLease.objects.filter(video_id=video.id).delete()
+
+
+def sync_review_queue_votes(videos):
+  """Copy the votes of reviewed videos to their review queue rows."""
+  ReviewQueue.objects.bulk_update([
+    ReviewQueue(video_id=video.id,
+                approved_count=video.review_summary['approved'],
+                rejected_count=video.review_summary['rejected'])
+    for video in videos
+    if int(video.status) == VideoStatus.PENDING_APPROVAL.value],
+    ['approved_count', 'rejected_count'])
+
+
+def update_gloss_counters(gloss_id, **deltas):
+  """
+  Add deltas to the video counters of a gloss in the database, e.g.
+  update_gloss_counters(1, approved_video_count=1).
+  """
+  Gloss.objects.filter(id=gloss_id).update(**{
+    field: Coalesce(F(field), 0) + delta for field, delta in deltas.items()})
+  transaction.on_commit(
+      lambda: recording_allocator.update_gloss(gloss_id, **deltas))
+
+
 def update_video_and_gloss_by_new_upload(video, video_path, thumbnail_path):
   """Save a newly uploaded video and update its gloss data accordingly."""
+  old_status = video.status
   video.video_path = video_path
   video.thumbnail = thumbnail_path
 
   if video.user_id == config.SAMPLE_VIDEO_USER_ID:
-    video.gloss.sample_video_id = video.id
+    Gloss.objects.filter(id=video.gloss_id).update(sample_video_id=video.id)
     video.status = VideoStatus.SAMPLE
   else:
-    video.review_summary = INITIAL_SUMMARY
+    video.review_summary = dict(INITIAL_SUMMARY)
     video.status = VideoStatus.PENDING_APPROVAL
-    video.gloss.pending_approval_video_count += 1
-
-  # hack for sample recording yinhuan
-  if user_id == 36:
-    video.status = VideoStatus.APPROVED
-    video.gloss.pending_approval_video_count -= 1
-    video.gloss.approved_video_count += 1
+    # hack for sample recording yinhuan
+    if video.user_id == 36:
+      video.status = VideoStatus.APPROVED
+      update_gloss_counters(video.gloss_id, approved_video_count=1)
+    else:
+      update_gloss_counters(video.gloss_id, pending_approval_video_count=1)
 
-  video.gloss.save()
   video.save()
+  sync_video_status(video, old_status)
+  invalidate_counts('videos')
+
 
+def count_review(video, action):
+  """
+  Count a review in video.review_summary and move the video to REJECTED or
+  APPROVED status once it has enough votes. Nothing is saved.
 
-def update_video_and_gloss_by_review(video, action):
+  :return: the changes of the gloss video counters, keyed by field name.
+  """
   if action == VideoStatus.REJECTED:
     video.review_summary['rejected'] += 1
   elif action == VideoStatus.APPROVED:
@@ -70,34 +334,300 @@ def update_video_and_gloss_by_review(video, action):
   if video.status == VideoStatus.PENDING_APPROVAL.value:
     if video.review_summary['rejected'] >= settings.MIN_REJECTION_COUNT_TO_REJECTED_STATUS:
       video.status = VideoStatus.REJECTED
-      video.gloss.rejected_video_count += 1
-      video.gloss.pending_approval_video_count -= 1
-      video.gloss.save()
+      return {'rejected_video_count': 1, 'pending_approval_video_count': -1}
     elif video.review_summary['approved'] >= settings.MIN_APPROVAL_COUNT_TO_APPROVAL_STATUS:
       video.status = VideoStatus.APPROVED
-      video.gloss.approved_video_count += 1
-      video.gloss.pending_approval_video_count -= 1
-      video.gloss.save()
-  video.save()
+      return {'approved_video_count': 1, 'pending_approval_video_count': -1}
+  return {}
+
+
+def review_videos(user_id, reviews):
+  """
+  Record the reviews of videos by a user in a single transaction.
+
+  The reviewed video rows are locked for the whole transaction so that
+  concurrent reviews of the same video are counted one after the other.
+  Scores are inserted in one batch and the gloss counters are updated once
+  per gloss. A user's second review of a video is ignored.
+
+  :param reviews: a list of (uuid, action) pairs, action is
+    VideoStatus.APPROVED or VideoStatus.REJECTED.
+  :return: a result dict per review, in order. Its code is 0 on success, in
+    which case it carries the video quality score, otherwise it carries an
+    error message.
+  """
+  with transaction.atomic():
+    videos = {video.uuid: video for video in Video.objects.select_for_update(
+      ).filter(uuid__in=[uuid for uuid, action in reviews]).order_by('id')}
+    video_ids = [video.id for video in videos.values()]
+    sample_video_ids = set(Gloss.objects.filter(
+        sample_video_id__in=video_ids).values_list('sample_video_id',
+                                                   flat=True))
+    reviewed_video_ids = set(Score.objects.filter(
+        user_id=user_id, video_id__in=video_ids,
+        score_type=ScoreType.REVIEW_VIDEO).values_list('video_id', flat=True))
+
+    now = int(time.time())
+    results = []
+    scores = []
+    reviewed = []
+    gloss_deltas = defaultdict(Counter)
+    for uuid, action in reviews:
+      video = videos.get(uuid)
+      if video is None:
+        results.append({'uuid': uuid, 'code': 404, 'message': _('Not Found')})
+        continue
+      if video.user_id == user_id:
+        results.append({'uuid': uuid, 'code': 50061,
+                        'message': _('User cannot review self video')})
+        continue
+      if video.id in sample_video_ids:
+        results.append({'uuid': uuid, 'code': 50062,
+                        'message': _('Forbid voting a sample video')})
+        continue
+
+      results.append({'uuid': uuid, 'code': 0})
+      if video.id in reviewed_video_ids:
+        continue
+      reviewed_video_ids.add(video.id)
+
+      scores.append(
+        # reviewer score
+        Score(user_id=user_id, video_id=video.id,
+              video_owner_id=video.user_id,
+              score_type=ScoreType.REVIEW_VIDEO,
+              value=ScoreValue.REVIEW_VIDEO, created_time=now))
+      quality = ScoreValue.APPROVE_VIDEO if action == VideoStatus.APPROVED \
+        else ScoreValue.REJECT_VIDEO
+      scores.append(
+        # owner's video quality score
+        Score(user_id=user_id, video_id=video.id,
+              video_owner_id=video.user_id,
+              score_type=ScoreType.VIDEO_QUALITY,
+              value=quality, created_time=now))
+      video.quality_score += quality.value
+      video.quality_count += 1
+      old_status = video.status
+      gloss_deltas[video.gloss_id].update(count_review(video, action))
+      reviewed.append((video, old_status))
+
+    if reviewed:
+      record_scores(scores)
+      Video.objects.bulk_update([video for video, old_status in reviewed],
+                                ['review_summary', 'status', 'quality_score',
+                                 'quality_count'])
+      for gloss_id, deltas in gloss_deltas.items():
+        if deltas:
+          update_gloss_counters(gloss_id, **deltas)
+      for video, old_status in reviewed:
+        sync_video_status(video, old_status)
+      sync_review_queue_votes([video for video, old_status in reviewed])
+      ReviewLease.objects.filter(
+          user_id=user_id,
+          video_id__in=[video.id for video, old_status in reviewed]).delete()
+      invalidate_counts('videos')
+
+  for result in results:
+    if result['code'] == 0:
+      result['video_score'] = videos[result['uuid']].quality_score
+  return results
+
+
+def review_votes_needed(approved, rejected):
+  """Return how many more votes may decide a video with the given votes."""
+  return min(settings.MIN_APPROVAL_COUNT_TO_APPROVAL_STATUS - approved,
+             settings.MIN_REJECTION_COUNT_TO_REJECTED_STATUS - rejected)
+
+
+def lease_review_tasks(user_id, count):
+  """
+  Hand out up to count queued videos for a user to review.
+
+  The videos closest to a decision come first, then the oldest ones. A video
+  is no longer handed out once its active leases cover the votes that may
+  decide it. Leases expire after settings.REVIEW_LEASE_SECONDS. Asking again
+  renews the user's leases of videos still queued and returns them first,
+  for up to settings.REVIEW_LEASE_MAX_SECONDS after they were taken. An
+  expired lease keeps its video from the same user for
+  REVIEW_LEASE_MAX_SECONDS more, so that the videos a user skips go to other
+  reviewers.
+
+  :return: (video ids, the earliest expiry time of their leases)
+  """
+  now = int(time.time())
+  expires_time = now + settings.REVIEW_LEASE_SECONDS
+  ReviewLease.objects.filter(
+      expires_time__lte=now - settings.REVIEW_LEASE_MAX_SECONDS).delete()
+  leases = ReviewLease.objects.filter(user_id=user_id, expires_time__gt=now,
+                                      video__review_queue__isnull=False)
+  leases.update(expires_time=Least(
+      Value(expires_time),
+      F('leased_time') + settings.REVIEW_LEASE_MAX_SECONDS))
+  held = list(leases.order_by('id').values_list('video_id', 'expires_time'))[
+      :count]
+  video_ids = [video_id for video_id, held_until in held]
+  expires_time = min([expires_time] + [held_until for video_id, held_until
+                                       in held])
+  if len(video_ids) >= count:
+    return video_ids, expires_time
+
+  reviewed = Score.objects.filter(
+      user_id=user_id, score_type=ScoreType.REVIEW_VIDEO,
+      video__review_queue__isnull=False).values('video_id')
+  candidates = list(ReviewQueue.objects.exclude(user_id=user_id).exclude(
+      video_id__in=reviewed).exclude(
+      video_id__in=ReviewLease.objects.filter(user_id=user_id).values(
+        'video_id')).exclude(
+      video__gloss__gloss_type=0).annotate(
+      leases=Count('video__review_leases', filter=Q(
+        video__review_leases__expires_time__gt=now)),
+      needed=Least(
+        Value(settings.MIN_APPROVAL_COUNT_TO_APPROVAL_STATUS) -
+        F('approved_count'),
+        Value(settings.MIN_REJECTION_COUNT_TO_REJECTED_STATUS) -
+        F('rejected_count'))).filter(needed__gt=F('leases')).order_by(
+      'needed', 'created_time', 'video_id').values_list(
+      'video_id', flat=True)[:count - len(video_ids)])
+
+  with transaction.atomic():
+    # Lock the chosen rows and check again, a concurrent call may have leased
+    # the same videos in the meantime. The lock is taken before anything is
+    # read in the transaction, so that the leases are counted from a snapshot
+    # of once it is held, including those of the calls that held it before.
+    votes = {video_id: (approved, rejected)
+             for video_id, approved, rejected in
+             ReviewQueue.objects.select_for_update().filter(
+               video_id__in=candidates).order_by('video_id').values_list(
+               'video_id', 'approved_count', 'rejected_count')}
+    lease_counts = Counter(ReviewLease.objects.filter(
+        video_id__in=list(votes), expires_time__gt=now).values_list(
+        'video_id', flat=True))
+    leased = [video_id for video_id in candidates if video_id in votes and
+              review_votes_needed(*votes[video_id]) >
+              lease_counts[video_id]]
+
+    ReviewLease.objects.bulk_create([
+      ReviewLease(video_id=video_id, user_id=user_id, leased_time=now,
+                  expires_time=now + settings.REVIEW_LEASE_SECONDS)
+      for video_id in leased])
+  return video_ids + leased, expires_time
+
+
+def get_param(qs, key, default=None):
+  """
+  Read a single request parameter from qs.
+
+  qs may be a plain dict or a dict built from a QueryDict, in which case every
+  value is a list.
+  """
+  value = qs.get(key, default)
+  if isinstance(value, list):
+    value = value[0] if value else default
+  return value
+
+
+def encode_cursor(values):
+  """Encode the sort key values of a row into an opaque page cursor."""
+  raw = ','.join(str(int(v)) for v in values)
+  return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+  """
+  Decode a cursor built by encode_cursor.
+
+  :raise ValueError: if the cursor is malformed.
+  """
+  try:
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    values = [int(v) for v in raw.split(',')]
+  except (binascii.Error, UnicodeDecodeError):
+    raise ValueError('Invalid cursor')
+  if len(values) != size:
+    raise ValueError('Invalid cursor')
+  return values
+
+
+def keyset_filter(fields, values):
+  """
+  Build the filter selecting rows after values in a descending ordering on
+  fields, e.g. (created_time, id) < (ct, id) for ('created_time', 'id').
+  """
+  condition = Q()
+  for i, field in enumerate(fields):
+    q = Q(**{field + '__lt': values[i]})
+    for prev_field, prev_value in zip(fields[:i], values[:i]):
+      q &= Q(**{prev_field: prev_value})
+    condition |= q
+  return condition
+
+
+def load_video_list(videos):
+  """
+  Restrict a video queryset to what VideoSerializer reads, joining the user
+  and gloss rows so a page is loaded in a single query.
+  """
+  return videos.select_related('user', 'gloss').only(*VIDEO_LIST_FIELDS)
+
+
+def iter_by_id(queryset, chunk_size):
+  """
+  Iterate over the rows of a queryset in id order, loading chunk_size rows
+  at a time with keyset queries, so that memory use does not grow with the
+  number of rows.
+  """
+  queryset = queryset.order_by('id')
+  last_id = None
+  while True:
+    chunk = queryset if last_id is None else queryset.filter(id__gt=last_id)
+    chunk = list(chunk[:chunk_size])
+    yield from chunk
+    if len(chunk) < chunk_size:
+      return
+    last_id = chunk[-1].id
 
 
 def get_videos(user, qs, status=VideoStatus.APPROVED):
+  """
+  Filter videos by request parameters and return one page of them.
+
+  Two paging modes are supported:
+    * offset paging with offset/limit, which always returns a total.
+    * keyset paging when a cursor parameter is present (empty for the first
+      page). A total is only returned when the total parameter is given.
+
+  The limit is brought within 1 and settings.MAX_PAGE_SIZE.
+
+  Rows are ordered by the order parameter, see VIDEO_ORDERINGS. Offset
+  paging keeps the database order when it is missing, keyset paging
+  defaults to 'latest'.
+
+  The total parameter is either exact or approx, see count_total. An
+  approximate total never counts rows, in offset paging it falls back to the
+  number of rows seen so far plus one if there are more.
+
+  :return: (videos, next_offset, total, next_cursor), total is None when it was
+    not counted, next_cursor is None in offset mode or on the last page.
+  :raise ValueError: if the cursor, the order or the categories are
+    malformed.
+  """
   try:
-    offset = int(qs['offset'][0]) if 'offset' in qs else 0
-    limit = int(qs['limit'][0]) if 'limit' in qs else settings.PAGE_SIZE
-  except TypeError:
+    offset = int(get_param(qs, 'offset', 0))
+    limit = int(get_param(qs, 'limit', settings.PAGE_SIZE))
+  except (TypeError, ValueError):
     offset = 0
-    limit = 10000
-  else:
-    try:
-      offset = int(qs['offset']) if 'offset' in qs else 0
-      limit = int(qs['limit']) if 'limit' in qs else settings.PAGE_SIZE
-    except TypeError:
-      offset = 0
-      limit = settings.PAGE_SIZE
-
-  categories = qs['cid'].split(',') if 'cid' in qs else []
-  query = qs['q'] if 'q' in qs else ''
+    limit = settings.PAGE_SIZE
+  offset = max(0, offset)
+  limit = max(1, min(limit, settings.MAX_PAGE_SIZE))
+
+  cid = get_param(qs, 'cid', '')
+  categories = [int(c) for c in cid.split(',')] if cid else []
+  query = get_param(qs, 'q', '')
+  cursor = get_param(qs, 'cursor')
+  order = get_param(qs, 'order', None if cursor is None else 'latest')
+  if order is not None and order not in VIDEO_ORDERINGS:
+    raise ValueError('Unknown order ' + order)
+  total_mode = get_param(qs, 'total', 'exact' if cursor is None else None)
 
   if type(status) == list:
     videos = Video.objects.filter(status__in=status)
@@ -107,9 +637,10 @@ def get_videos(user, qs, status=VideoStatus.APPROVED):
   author = 0
   if 'author' in qs:
     try:
-      author = user.id if qs['author'] == 'self' else int(qs['author'])
-    except TypeError:
-      pass
+      author = get_param(qs, 'author')
+      author = user.id if author == 'self' else int(author)
+    except (TypeError, ValueError):
+      author = 0
 
   if author:
     videos = videos.filter(user_id=author)
@@ -120,50 +651,271 @@ def get_videos(user, qs, status=VideoStatus.APPROVED):
 
   unreviewed = 'unreviewed' in qs
   if unreviewed:
-    videos = videos.filter(~Q(score__user__id=user.id,
-                              score__score_type=ScoreType.REVIEW_VIDEO))
+    # Only the user's reviews of queued videos are looked at, so the cost
+    # follows the queue length rather than the user's review history.
+    reviewed = Score.objects.filter(
+        user_id=user.id, score_type=ScoreType.REVIEW_VIDEO,
+        video__review_queue__isnull=False).values('video_id')
+    videos = videos.filter(review_queue__isnull=False).exclude(
+        id__in=reviewed)
 
   if len(categories) > 0:
-    videos = videos.filter(category_id__in=categories)
+    videos = videos.filter(gloss_id__in=category_gloss_ids(categories))
 
   if query != '':
-    videos = videos.filter(gloss_text__contains=query)
+    videos = videos.filter(gloss_id__in=search.search_glosses(query))
 
   videos = videos.exclude(gloss__gloss_type=0)
+  videos = load_video_list(videos)
+  if order is not None:
+    sort_fields = VIDEO_ORDERINGS[order]
+    videos = videos.order_by(*['-' + field for field in sort_fields])
+
+  total = None
+  if total_mode:
+    params = {
+      'user': user.id,
+      'status': [int(s) for s in status] if type(status) == list else int(
+          status),
+      'author': author,
+      'unreviewed': unreviewed,
+      'categories': categories,
+      'q': query,
+    }
+    total = count_total('videos', params, videos, total_mode)
+
+  if cursor is None:
+    # Fetch one more row than requested to tell whether a next page exists.
+    data = list(videos[offset: offset + limit + 1])
+    has_more = len(data) > limit
+    data = data[:limit]
+    if total is None:
+      total = offset + len(data) + (1 if has_more else 0)
+    next_offset = offset + limit if has_more else 0
+    return data, next_offset, total, None
+
+  if cursor:
+    videos = videos.filter(
+        keyset_filter(sort_fields, decode_cursor(cursor, len(sort_fields))))
+
+  # Fetch one more row than requested to tell whether a next page exists.
+  data = list(videos[:limit + 1])
+  has_more = len(data) > limit
+  data = data[:limit]
+  next_cursor = None
+  if has_more and data:
+    next_cursor = encode_cursor(
+        [getattr(data[-1], field) for field in sort_fields])
+  return data, 0, total, next_cursor
+
+
+def get_unrecorded_glosses(user_id, cursor, limit):
+  """
+  Page through the glosses a user has no video of, in id order.
+
+  :param cursor: the cursor returned with the previous page, empty for the
+    first page.
+  :param limit: the page size, at least 1, None for all the remaining
+    glosses.
+  :return: (glosses, next_cursor), next_cursor is None on the last page.
+  :raise ValueError: if the cursor is malformed.
+  """
+  recorded = Video.objects.filter(user_id=user_id).values('gloss_id')
+  glosses = Gloss.objects.exclude(gloss_type=0).exclude(id__in=recorded)
+  if cursor:
+    glosses = glosses.filter(id__gt=decode_cursor(cursor, 1)[0])
+  glosses = glosses.prefetch_related(
+      'sample_video__user', 'sample_video__gloss', 'categories').order_by('id')
+  if limit is None:
+    return list(glosses), None
+  glosses = list(glosses[:limit + 1])
+
+  has_more = len(glosses) > limit
+  glosses = glosses[:limit]
+  next_cursor = None
+  if has_more and glosses:
+    next_cursor = encode_cursor([glosses[-1].id])
+  return glosses, next_cursor
+
+
+def compute_video_scores():
+  """
+  Aggregate the VIDEO_QUALITY scores of every scored video.
 
-  total = videos.count()
-  next_offset = offset + limit if offset + limit < total else 0
-  data = videos[offset: offset + limit]
-  return data, next_offset, total
+  :return: a dict of (total, count) keyed by video id.
+  """
+  return {video_id: (total or 0, count) for video_id, total, count in
+          Score.objects.filter(score_type=ScoreType.VIDEO_QUALITY).values_list(
+            'video_id').annotate(total=Sum('value'),
+                                 count=Count('value')).order_by()}
 
 
-def get_video_score(video_id):
+def increment_row(model, keys, **deltas):
+  """
+  Add deltas to the counter fields of the row of model matching keys,
+  creating the row if needed. model must be unique on the keys fields.
+  """
+  rows = model.objects.filter(**keys)
+  changes = {field: F(field) + delta for field, delta in deltas.items()}
+  if rows.update(**changes):
+    return
   try:
-    video_score = Score.objects.filter(
-        video_id=video_id, score_type=ScoreType.VIDEO_QUALITY).annotate(
-        total=Sum('value'))[0].total
-  except (Score.DoesNotExist, IndexError):
-    video_score = 0
+    with transaction.atomic():
+      model.objects.create(**keys, **deltas)
+  except IntegrityError:
+    # Created by a concurrent transaction in the meantime.
+    rows.update(**changes)
+
+
+def add_user_score(user_id, score_type, total, count):
+  """Add to the score ledger row of a user, creating it if needed."""
+  increment_row(UserScore, {'user_id': user_id, 'score_type': score_type},
+                total=total, count=count)
+
 
-  return video_score
+def record_scores(scores):
+  """
+  Insert scores and add them to the score ledger, see UserScore. Call it in
+  the transaction that makes the scores' changes.
+  """
+  Score.objects.bulk_create(scores)
+
+  uncounted_video_ids = set(Video.objects.filter(
+      id__in={score.video_id for score in scores},
+      gloss__gloss_type=0).values_list('id', flat=True))
+  changes = defaultdict(Counter)
+  for score in scores:
+    if score.video_id in uncounted_video_ids:
+      continue
+    score_type = int(score.score_type)
+    if score_type == ScoreType.VIDEO_QUALITY.value:
+      user_id = score.video_owner_id
+    else:
+      user_id = score.user_id
+    changes[(user_id, score_type)].update(total=int(score.value), count=1)
+
+  for (user_id, score_type), change in sorted(changes.items()):
+    add_user_score(user_id, score_type, change['total'], change['count'])
+
+
+def compute_user_scores():
+  """
+  Aggregate the raw scores of every user, as the score ledger should hold
+  them.
+
+  :return: a dict of (total, count) keyed by (user id, score type).
+  """
+  scores = Score.objects.exclude(video__gloss__gloss_type=0)
+  by_user = scores.exclude(score_type=ScoreType.VIDEO_QUALITY).values_list(
+      'user_id', 'score_type')
+  by_owner = scores.filter(score_type=ScoreType.VIDEO_QUALITY).values_list(
+      'video_owner_id', 'score_type')
+
+  result = {}
+  for rows in (by_user, by_owner):
+    for user_id, score_type, total, count in rows.annotate(
+        total=Sum('value'), count=Count('value')).order_by():
+      result[(user_id, score_type)] = (total or 0, count)
+  return result
 
 
 def get_user_scores(user_id):
   scores = {str(key) + '_score': 0 for key in ScoreType}
   counts = {str(key) + '_count': 0 for key in ScoreType}
-  try:
-    user_score_model = Score.objects.values(
-      'score_type').exclude(video__gloss__gloss_type=0).filter(
-        (Q(user_id=user_id) &
-        ~Q(score_type=ScoreType.VIDEO_QUALITY)) |
-        (Q(video_owner_id=user_id) &
-        Q(score_type=ScoreType.VIDEO_QUALITY))).annotate(
-        total=Sum('value'), count=Count('value'))
-  except Score.DoesNotExist:
-    user_score_model = {}
-
-  if user_score_model:
-    for s in user_score_model:
-      scores[str(ScoreType(s['score_type'])) + '_score'] = s['total']
-      counts[str(ScoreType(s['score_type'])) + '_count'] = s['count']
+
+  for score_type, total, count in UserScore.objects.filter(
+      user_id=user_id).values_list('score_type', 'total', 'count'):
+    scores[str(ScoreType(score_type)) + '_score'] = total
+    counts[str(ScoreType(score_type)) + '_count'] = count
   return {**counts, **scores}
+
+
+def get_statistics():
+  """
+  Compute the admin statistics, cached for settings.STATISTIC_CACHE_TIMEOUT
+  seconds. The query count does not depend on the number of users.
+
+  :return: a dict of user_stats, the video counts of each user by status,
+    daily_stats, the count of videos created each day (UTC) from the
+    DailyContribution rollup, and score_stats, the scores of each user with
+    videos, from UserScore.
+  """
+  statistics = cache.get('statistics')
+  if statistics is not None:
+    return statistics
+
+  user_stats = list(Video.objects.filter(
+    status__gt=VideoStatus.SAMPLE).values('user_id').annotate(
+    username=F('user__username'),
+    total_count=Count('id'),
+    pending_count=Count('id', filter=Q(status=VideoStatus.PENDING_APPROVAL)),
+    approved_count=Count('id', filter=Q(status=VideoStatus.APPROVED)),
+    rejected_count=Count('id', filter=Q(status=VideoStatus.REJECTED)),
+  ).order_by('user_id'))
+
+  daily_stats = [
+    {'date': date.strftime('%Y-%m-%d'), 'count': count}
+    for date, count in DailyContribution.objects.filter(
+      status__gt=VideoStatus.WAITING_UPLOAD).values('date').annotate(
+      count=Sum('count')).values_list('date', 'count').order_by('date')
+    if count]
+
+  scores = defaultdict(dict)
+  for user_id, score_type, total in UserScore.objects.filter(
+      user_id__in=[stat['user_id'] for stat in user_stats]).values_list(
+      'user_id', 'score_type', 'total'):
+    scores[user_id][score_type] = total
+  score_stats = [{
+    'username': stat['username'],
+    'created_video_score': scores[stat['user_id']].get(
+      ScoreType.CREATE_VIDEO.value, 0),
+    'approved_video_score': scores[stat['user_id']].get(
+      ScoreType.VIDEO_QUALITY.value, 0),
+    'review_video_score': scores[stat['user_id']].get(
+      ScoreType.REVIEW_VIDEO.value, 0),
+    'total_score': sum(scores[stat['user_id']].values()),
+  } for stat in user_stats]
+
+  statistics = {
+    'user_stats': user_stats,
+    'daily_stats': daily_stats,
+    'score_stats': score_stats,
+  }
+  cache.set('statistics', statistics, settings.STATISTIC_CACHE_TIMEOUT)
+  return statistics
+
+
+def complete_upload(video, user_id, video_path, thumbnail_path, sha256=None,
+                    metadata=None):
+  """
+  Update video and gloss data of a stored upload, score its owner and
+  schedule the processing of the uploaded file.
+
+  :param sha256: the checksum of the file, if computed while uploading. The
+    file is then content addressed, see uploads.acquire_blob.
+  :param metadata: the uploads.probe_video results of the file, if probed.
+  :return: the video path saved, the one of the stored file of the same
+    content if any.
+  """
+  with transaction.atomic():
+    old_name = video.video_path.name if video.video_path else None
+    if sha256:
+      video_path = os.path.join(settings.MEDIA_URL, uploads.acquire_blob(
+        sha256, uploads.storage_name(video_path)))
+    video.processing_status = ProcessingStatus.PENDING
+    video.processing_attempts = 0
+    video.processing_error = ''
+    for field in uploads.METADATA_FIELDS:
+      setattr(video, field, (metadata or {}).get(field))
+    video.sha256 = sha256
+    update_video_and_gloss_by_new_upload(video, video_path, thumbnail_path)
+    record_scores([Score(user_id=user_id,
+                         video_id=video.id,
+                         video_owner_id=user_id,
+                         score_type=ScoreType.CREATE_VIDEO,
+                         value=ScoreValue.CREATE_VIDEO,
+                         created_time=int(time.time()))])
+    if old_name:
+      uploads.release_blob(uploads.storage_name(old_name))
+    processing.schedule(video.id)
+  return video_path
@@ -77,6 +77,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'cslt.wsgi.application'
 
+TEST_RUNNER = 'cslt.test_runner.UnmanagedModelTestRunner'
+
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
@@ -156,8 +158,55 @@ PENDING_APPROVAL_VIDEO_LIMIT_PER_USER = config.PENDING_APPROVAL_VIDEO_LIMIT_PER_
 REVIEW_MINIMUM_TURNOUT = config.REVIEW_MINIMUM_TURNOUT
 MIN_REJECTION_COUNT_TO_REJECTED_STATUS = int(round(REVIEW_MINIMUM_TURNOUT * 0.2)) + 1
 MIN_APPROVAL_COUNT_TO_APPROVAL_STATUS = REVIEW_MINIMUM_TURNOUT - MIN_REJECTION_COUNT_TO_REJECTED_STATUS + 1
+# Maximum number of reviews in one batch review request.
+REVIEW_BATCH_LIMIT = 100
+# Seconds a reviewer keeps the review tasks handed out to them.
+REVIEW_LEASE_SECONDS = 300
+# Seconds a reviewer may keep renewing a lease, and then seconds before the
+# video is handed out to them again.
+REVIEW_LEASE_MAX_SECONDS = 900
+# Uploaded videos shorter than this many seconds are rejected.
+MIN_VIDEO_DURATION = 0.5
+# Maximum size in bytes of a video uploaded through a resumable upload.
+UPLOAD_MAX_SIZE = 200 * 1024 * 1024
+# Maximum size in bytes of one chunk of a resumable upload.
+UPLOAD_CHUNK_MAX_SIZE = 8 * 1024 * 1024
+# Bytes of an uploaded video written to the storage at a time.
+UPLOAD_STREAM_CHUNK_SIZE = 1024 * 1024
+# Seconds before an unfinished resumable upload is purged.
+UPLOAD_SESSION_MAX_AGE = 24 * 3600
+# Widths of the thumbnail variants served for ?w=, and the one of list items.
+THUMBNAIL_WIDTHS = (80, 160, 320)
+THUMBNAIL_LIST_WIDTH = 160
+THUMBNAIL_QUALITY = 80
+# Bytes of storage for thumbnail variants, the least recently used ones are
+# evicted beyond it.
+THUMBNAIL_CACHE_BUDGET = 512 * 1024 * 1024
+# Seconds between two updates of the access time of a thumbnail variant.
+THUMBNAIL_ACCESS_RESOLUTION = 3600
+# Threads processing uploaded videos, 0 processes them in the request thread.
+VIDEO_PROCESSING_WORKERS = 2
+# Retries of a failed video processing step, and seconds before the first.
+VIDEO_PROCESSING_RETRIES = 2
+VIDEO_PROCESSING_RETRY_DELAY = 1
 
 PAGE_SIZE = 10
+# Largest page of the video lists.
+MAX_PAGE_SIZE = 100
+# Default number of glosses in a page of the reference recording bunch.
+REFERENCE_BUNCH_PAGE_SIZE = 50
+# Seconds a cached list total stays valid when no write invalidates it.
+COUNT_CACHE_TIMEOUT = 60
+# Videos loaded per query by the streamed video exports.
+EXPORT_CHUNK_SIZE = 1000
+# Seconds the admin statistics are cached.
+STATISTIC_CACHE_TIMEOUT = 60
+# Seconds before the in-process gloss search index is rebuilt from the database.
+GLOSS_INDEX_REFRESH_INTERVAL = 300
+# Most glosses a text search returns, best matches first.
+GLOSS_SEARCH_MAX_RESULTS = 500
+# Seconds before the in-process recording allocator reloads its counters.
+RECORDING_ALLOCATOR_REFRESH_INTERVAL = 60
 
 LANGUAGES = (
   ('zh-hans', '中文简体'),
@@ -177,5 +226,9 @@ if config.ENV.__name__ == 'envs.gae':
     SERVICE_ACCOUNT_FILE)
   GS_LOCATION = MEDIA_URL
   MEDIA_URL = 'https://{}.storage.googleapis.com/media/'.format(GS_BUCKET_NAME)
+  # Spool files written to the bucket to disk beyond one upload chunk, and
+  # send them in bounded chunks.
+  GS_MAX_MEMORY_SIZE = UPLOAD_STREAM_CHUNK_SIZE
+  GS_BLOB_CHUNK_SIZE = 4 * 1024 * 1024
 
 LOGGING = config.LOGGING
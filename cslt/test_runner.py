@@ -0,0 +1,34 @@
+"""
+Test runner creating the tables of the cslt models.
+
+The cslt tables are created by hand in production, so their models are
+unmanaged and the test database would lack them. They are made managed for
+the test run.
+"""
+from unittest import mock
+
+from django.apps import apps
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.test.runner import DiscoverRunner
+
+
+class UnmanagedModelTestRunner(DiscoverRunner):
+  def setup_databases(self, **kwargs):
+    for model in apps.get_app_config('cslt').get_models():
+      model._meta.managed = True
+
+    # Category.glosses and Gloss.categories share cslt_category_gloss, the
+    # table must only be created once.
+    create_model = BaseDatabaseSchemaEditor.create_model
+    created = set()
+
+    def create_model_once(editor, model):
+      if model._meta.app_label == 'cslt':
+        if model._meta.db_table in created:
+          return
+        created.add(model._meta.db_table)
+      create_model(editor, model)
+
+    with mock.patch.object(BaseDatabaseSchemaEditor, 'create_model',
+                           create_model_once):
+      return super(UnmanagedModelTestRunner, self).setup_databases(**kwargs)
@@ -0,0 +1,1087 @@
+import hashlib
+import io
+import os
+import random
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, \
+  override_settings, skipUnlessDBFeature
+from django.test.client import BOUNDARY, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APIRequestFactory, \
+  force_authenticate
+
+from cslt import services, settings, config, uploads, media, processing, \
+  search, mp4, thumbnails
+from cslt.allocator import RecordingAllocator, recording_allocator
+from cslt.api_views import UploadView
+from cslt.search import GlossIndex, gloss_index
+from cslt.serializers import thumbnail_variant_url
+from cslt.utils import BackgroundBuilt
+from cslt.models import Gloss, Video, VideoStatus, ReviewQueue, Category, \
+  Score, ScoreType, UserScore, UserVideoCount, DailyContribution, \
+  ReviewLease, MediaBlob, ProcessingStatus, ThumbnailVariant
+
+
+def create_gloss(text, **kwargs):
+  for field in ('pending_approval_video_count', 'rejected_video_count',
+                'approved_video_count'):
+    kwargs.setdefault(field, 0)
+  return Gloss.objects.create(text=text, gloss_type=1,
+                              created_time=int(time.time()), duration=0,
+                              **kwargs)
+
+
+def create_video(user, gloss, status=VideoStatus.PENDING_APPROVAL, **kwargs):
+  kwargs.setdefault('created_time', int(time.time()))
+  video = Video.objects.create(uuid=str(uuid.uuid4()), user=user, gloss=gloss,
+                               review_summary={'approved': 0, 'rejected': 0},
+                               video_path='/media/2020-03/video.mp4',
+                               thumbnail='/media/2020-03/thumbnail.png',
+                               status=status, **kwargs)
+  if status == VideoStatus.PENDING_APPROVAL:
+    ReviewQueue.objects.create(video=video, user=user,
+                               created_time=video.created_time)
+  return video
+
+
+def box(box_type, *payloads):
+  payload = b''.join(payloads)
+  return struct.pack('>I4s', 8 + len(payload), box_type.encode()) + payload
+
+
+def build_mp4(data=b'frame' * 64):
+  """Build a 2 seconds mp4 file of one video track, movie box last."""
+  ftyp = box('ftyp', b'isom', bytes(4))
+  # One chunk, the media data.
+  stco = box('stco', bytes(4), struct.pack('>II', 1, len(ftyp) + 8))
+  moov = box(
+    'moov',
+    box('mvhd', bytes(12), struct.pack('>II', 1000, 2000), bytes(80)),
+    box('trak',
+        box('tkhd', bytes(76), struct.pack('>II', 640 << 16, 480 << 16)),
+        box('mdia', box('hdlr', bytes(8), b'vide', bytes(12)),
+            box('minf', box('stbl', stco)))))
+  return ftyp + box('mdat', data) + moov
+
+
+class CsltTestCase(TestCase):
+  def setUp(self):
+    # Count caches and statistics live in the process cache.
+    cache.clear()
+    self.users = [User.objects.create(username='user{}'.format(i))
+                  for i in range(3)]
+    self.glosses = [create_gloss('gloss{}'.format(i)) for i in range(5)]
+
+  def client_of(self, user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+class VideoListQueryTest(CsltTestCase):
+  """A page of videos is loaded with its users and glosses in one query."""
+
+  def setUp(self):
+    super(VideoListQueryTest, self).setUp()
+    for i in range(30):
+      create_video(self.users[i % 3], self.glosses[i % 5],
+                   created_time=1000 + i)
+    self.client = self.client_of(self.users[0])
+
+  def assertPageQueries(self, num, url):
+    with self.assertNumQueries(num):
+      response = self.client.get(url).json()
+    self.assertEqual(response['code'], 0)
+    self.assertTrue(response['data']['data'])
+    for item in response['data']['data']:
+      self.assertTrue(item['creator']['username'])
+      self.assertTrue(item['gloss_text'])
+
+  def test_offset_page(self):
+    # The total is counted once, then served from the count cache.
+    self.assertPageQueries(2, '/api/videos?limit=10')
+    self.assertPageQueries(1, '/api/videos?limit=20&offset=10')
+
+  def test_cursor_page(self):
+    self.assertPageQueries(1, '/api/videos?cursor=&limit=20')
+
+  def test_self_and_unreviewed_pages(self):
+    self.assertPageQueries(1, '/api/videos/self?cursor=&limit=10')
+    self.assertPageQueries(1, '/api/videos/unreviewed?cursor=&limit=10')
+
+  def test_single_video(self):
+    video = Video.objects.filter(user=self.users[1]).first()
+    with self.assertNumQueries(1):
+      response = self.client.get('/api/videos/' + video.uuid).json()
+    self.assertEqual(response['data']['creator']['username'], 'user1')
+
+
+class VideoPagingTest(CsltTestCase):
+  def setUp(self):
+    super(VideoPagingTest, self).setUp()
+    for i in range(3):
+      create_video(self.users[1], self.glosses[i], created_time=1000 + i)
+    self.client = self.client_of(self.users[0])
+
+  def test_limit_is_clamped(self):
+    for url in ('/api/videos/unreviewed?cursor=&limit=0',
+                '/api/videos/unreviewed?cursor=&limit=-5',
+                '/api/videos?limit=-1&offset=-3'):
+      response = self.client.get(url).json()
+      self.assertEqual(response['code'], 0, url)
+      self.assertEqual(len(response['data']['data']), 1, url)
+
+  def test_cursor_pages(self):
+    response = self.client.get('/api/videos?cursor=&limit=2').json()['data']
+    self.assertEqual(len(response['data']), 2)
+    response = self.client.get('/api/videos?limit=2&cursor=' +
+                               response['next_cursor']).json()['data']
+    self.assertEqual(len(response['data']), 1)
+    self.assertIsNone(response['next_cursor'])
+
+
+class CountCacheTest(CsltTestCase):
+  def test_category_membership_invalidates_totals(self):
+    category = Category.objects.create(title='category', seq=0, parent=None)
+    self.glosses[0].categories.add(category)
+    client = self.client_of(self.users[0])
+    url = '/api/glosses/?cid={}'.format(category.id)
+    self.assertEqual(client.get(url).json()['data']['total'], 1)
+
+    self.glosses[1].categories.add(category)
+    self.assertEqual(client.get(url).json()['data']['total'], 2)
+    category.glosses.remove(self.glosses[0])
+    self.assertEqual(client.get(url).json()['data']['total'], 1)
+
+
+def run_threads(target, args_list):
+  """Run target once per args in parallel threads, raising their errors."""
+  barrier = threading.Barrier(len(args_list))
+  errors = []
+
+  def run(*args):
+    try:
+      barrier.wait()
+      target(*args)
+    except Exception as e:
+      errors.append(e)
+    finally:
+      connection.close()
+
+  threads = [threading.Thread(target=run, args=args) for args in args_list]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  if errors:
+    raise errors[0]
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentReviewTest(TransactionTestCase):
+  """Parallel reviews of the same videos are all counted, once each."""
+
+  def test_parallel_reviews(self):
+    cache.clear()
+    owner = User.objects.create(username='owner')
+    reviewers = [User.objects.create(username='reviewer{}'.format(i))
+                 for i in range(8)]
+    gloss = create_gloss('gloss', pending_approval_video_count=3)
+    videos = [create_video(owner, gloss) for i in range(3)]
+    actions = [VideoStatus.REJECTED if i % 3 == 0 else VideoStatus.APPROVED
+               for i in range(len(reviewers))]
+
+    run_threads(services.review_videos, [
+      (reviewer.id, [(video.uuid, action) for video in videos])
+      for reviewer, action in zip(reviewers, actions)])
+    # A second review of a video by the same user is ignored.
+    run_threads(services.review_videos, [
+      (reviewers[0].id, [(videos[0].uuid, VideoStatus.APPROVED)])] * 4)
+
+    approved = actions.count(VideoStatus.APPROVED)
+    rejected = actions.count(VideoStatus.REJECTED)
+    for video in videos:
+      video.refresh_from_db()
+      self.assertEqual(video.review_summary,
+                       {'approved': approved, 'rejected': rejected})
+      self.assertEqual(video.quality_count, len(reviewers))
+      self.assertEqual(video.quality_score, 2 * approved)
+      self.assertNotEqual(video.status, VideoStatus.PENDING_APPROVAL.value)
+      self.assertEqual(Score.objects.filter(video=video).count(),
+                       2 * len(reviewers))
+    self.assertFalse(ReviewQueue.objects.exists())
+
+    # Each video left the pending count exactly once.
+    gloss.refresh_from_db()
+    self.assertEqual(gloss.pending_approval_video_count, 0)
+    self.assertEqual(
+      gloss.approved_video_count + gloss.rejected_video_count, len(videos))
+
+    self.assertEqual(UserScore.objects.get(
+      user=owner, score_type=ScoreType.VIDEO_QUALITY).total,
+                     2 * approved * len(videos))
+    for reviewer in reviewers:
+      self.assertEqual(UserScore.objects.get(
+        user=reviewer, score_type=ScoreType.REVIEW_VIDEO).count, len(videos))
+
+
+class ReconcileTest(CsltTestCase):
+  def reconcile(self, command, *args):
+    out = io.StringIO()
+    call_command(command, *args, stdout=out)
+    return out.getvalue().splitlines()
+
+  def test_user_scores(self):
+    video = create_video(self.users[0], self.glosses[0])
+    services.review_videos(self.users[1].id,
+                           [(video.uuid, VideoStatus.APPROVED)])
+    UserScore.objects.filter(user=self.users[0]).update(total=7)
+    UserScore.objects.filter(user=self.users[1]).delete()
+
+    lines = self.reconcile('reconcile_user_scores', '--dry-run')
+    self.assertEqual(lines[-1], '2 drifted ledger rows')
+    self.assertEqual(UserScore.objects.get(user=self.users[0]).total, 7)
+
+    lines = self.reconcile('reconcile_user_scores')
+    self.assertEqual(lines[-1], '2 drifted ledger rows fixed')
+    self.assertEqual(UserScore.objects.get(user=self.users[0]).total, 2)
+    self.assertEqual(UserScore.objects.get(user=self.users[1]).count, 1)
+    lines = self.reconcile('reconcile_user_scores')
+    self.assertEqual(lines, ['0 drifted ledger rows fixed'])
+
+  def test_video_scores(self):
+    video = create_video(self.users[0], self.glosses[0])
+    services.review_videos(self.users[1].id,
+                           [(video.uuid, VideoStatus.APPROVED)])
+    other = create_video(self.users[0], self.glosses[1])
+    Video.objects.filter(id=video.id).update(quality_score=0)
+    Video.objects.filter(id=other.id).update(quality_score=4, quality_count=2)
+
+    lines = self.reconcile('reconcile_video_scores')
+    self.assertEqual(lines[-1], '2 drifted videos fixed')
+    self.assertEqual(Video.objects.values_list('quality_score',
+                                               'quality_count').get(
+      id=video.id), (2, 1))
+    self.assertEqual(Video.objects.values_list('quality_score',
+                                               'quality_count').get(
+      id=other.id), (0, 0))
+
+  def test_user_video_counts(self):
+    services.create_videos(self.users[0], [gloss.id for gloss in self.glosses])
+    UserVideoCount.objects.filter(user=self.users[0]).update(count=1)
+
+    lines = self.reconcile('reconcile_user_video_counts')
+    self.assertEqual(lines, [
+      'user {} status 0: counter 1, videos 5'.format(self.users[0].id),
+      '1 drifted counters fixed'])
+    self.assertEqual(services.get_user_video_count(
+      self.users[0].id, VideoStatus.WAITING_UPLOAD), 5)
+
+  def test_daily_contributions(self):
+    services.create_videos(self.users[0], [self.glosses[0].id])
+    today = services.video_date(int(time.time()))
+    DailyContribution.objects.all().delete()
+
+    lines = self.reconcile('rollup_daily_contributions', '--days', '1',
+                           '--dry-run')
+    self.assertEqual(lines, [
+      '{} user {} status 0: rollup 0, videos 1'.format(today,
+                                                       self.users[0].id),
+      '1 drifted rollup rows'])
+    self.reconcile('rollup_daily_contributions')
+    self.assertEqual(DailyContribution.objects.get(date=today).count, 1)
+
+
+class ReviewLeaseTest(CsltTestCase):
+  def setUp(self):
+    super(ReviewLeaseTest, self).setUp()
+    self.now = 1000000
+    patcher = mock.patch.object(services.time, 'time', lambda: self.now)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    # Three approvals or one rejection decide a video.
+    for name, value in (('MIN_APPROVAL_COUNT_TO_APPROVAL_STATUS', 3),
+                        ('MIN_REJECTION_COUNT_TO_REJECTED_STATUS', 1),
+                        ('REVIEW_LEASE_SECONDS', 300),
+                        ('REVIEW_LEASE_MAX_SECONDS', 900)):
+      patcher = mock.patch.object(settings, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def test_decided_video_is_not_returned(self):
+    video = create_video(self.users[0], self.glosses[0])
+    self.assertEqual(services.lease_review_tasks(self.users[1].id, 5)[0],
+                     [video.id])
+    services.review_videos(self.users[2].id,
+                           [(video.uuid, VideoStatus.REJECTED)])
+    self.assertFalse(ReviewLease.objects.exists())
+    self.assertEqual(services.lease_review_tasks(self.users[1].id, 5)[0], [])
+
+  def test_renewal_is_capped(self):
+    video = create_video(self.users[0], self.glosses[0])
+    leased_time = self.now
+    services.lease_review_tasks(self.users[1].id, 5)
+    for i in range(2):
+      self.now += 299
+      self.assertEqual(services.lease_review_tasks(self.users[1].id, 5),
+                       ([video.id], self.now + 300))
+    self.now += 299
+    self.assertEqual(services.lease_review_tasks(self.users[1].id, 5),
+                     ([video.id], leased_time + 900))
+
+    # The video goes to another reviewer, then back after the hold.
+    self.now = leased_time + 900
+    self.assertEqual(services.lease_review_tasks(self.users[1].id, 5)[0], [])
+    self.assertEqual(services.lease_review_tasks(self.users[2].id, 1)[0],
+                     [video.id])
+    self.now += 900
+    self.assertEqual(services.lease_review_tasks(self.users[1].id, 5)[0],
+                     [video.id])
+
+  def test_simulated_reviewers(self):
+    """
+    Reviewers lease tasks and review most of them, approving good videos
+    and rejecting bad ones, some by mistake.
+    """
+    rng = random.Random(0)
+    reviewers = [User.objects.create(username='reviewer{}'.format(i))
+                 for i in range(8)]
+    videos = {create_video(self.users[0], self.glosses[i % 5]).id:
+              rng.random() < 0.8 for i in range(40)}
+
+    for step in range(100):
+      if not ReviewQueue.objects.exists():
+        break
+      for reviewer in reviewers:
+        video_ids = services.lease_review_tasks(reviewer.id, 3)[0]
+        reviews = []
+        for video in Video.objects.filter(id__in=video_ids):
+          self.assertEqual(video.status, VideoStatus.PENDING_APPROVAL.value)
+          if rng.random() < 0.8:
+            good = videos[video.id] != (rng.random() < 0.05)
+            reviews.append((video.uuid, VideoStatus.APPROVED if good
+                            else VideoStatus.REJECTED))
+        services.review_videos(reviewer.id, reviews)
+
+        # Leases never cover more votes than may decide a video.
+        for queued in ReviewQueue.objects.all():
+          self.assertLessEqual(
+            ReviewLease.objects.filter(video_id=queued.video_id,
+                                       expires_time__gt=self.now).count(),
+            services.review_votes_needed(queued.approved_count,
+                                         queued.rejected_count))
+      self.now += 60
+
+    self.assertFalse(ReviewQueue.objects.exists())
+    # No video got a vote once decided.
+    for video in Video.objects.filter(id__in=videos):
+      summary = video.review_summary
+      if video.status == VideoStatus.APPROVED.value:
+        self.assertEqual(summary['approved'], 3)
+        self.assertEqual(summary['rejected'], 0)
+      else:
+        self.assertEqual(summary['rejected'], 1)
+        self.assertLess(summary['approved'], 3)
+
+
+class ReferenceBunchTest(CsltTestCase):
+  def setUp(self):
+    super(ReferenceBunchTest, self).setUp()
+    self.client = self.client_of(User.objects.create(
+      id=config.SAMPLE_VIDEO_USER_ID, username='reference'))
+
+  def test_pages(self):
+    response = self.client.get('/api/bunch/?cursor=&limit=3').json()['data']
+    self.assertEqual([gloss['text'] for gloss in response['data']],
+                     ['gloss0', 'gloss1', 'gloss2'])
+    response = self.client.get('/api/bunch/?limit=3&cursor=' +
+                               response['next_cursor']).json()['data']
+    self.assertEqual([gloss['text'] for gloss in response['data']],
+                     ['gloss3', 'gloss4'])
+    self.assertIsNone(response['next_cursor'])
+
+  def test_unpaged(self):
+    with mock.patch.object(settings, 'REFERENCE_BUNCH_PAGE_SIZE', 2):
+      response = self.client.get('/api/bunch/').json()
+      self.assertEqual(len(response['data']), 5)
+      response = self.client.get('/api/bunch/?limit=3').json()
+      self.assertEqual(len(response['data']), 3)
+
+  def test_invalid_limit(self):
+    for limit in ('0', '-1', 'x', str(settings.MAX_PAGE_SIZE + 1)):
+      response = self.client.get('/api/bunch/?cursor=&limit=' + limit).json()
+      self.assertEqual(response['code'], 6701, limit)
+
+
+class MediaTestCase(CsltTestCase):
+  """Stores the media files in a temporary directory."""
+
+  def setUp(self):
+    super(MediaTestCase, self).setUp()
+    self.media_root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.media_root)
+    media_settings = override_settings(MEDIA_ROOT=self.media_root)
+    media_settings.enable()
+    self.addCleanup(media_settings.disable)
+
+  def media_files(self):
+    return [os.path.join(directory, name)
+            for directory, directories, names in os.walk(self.media_root)
+            for name in names]
+
+
+class UploadSessionTest(MediaTestCase):
+  def setUp(self):
+    super(UploadSessionTest, self).setUp()
+    self.user = self.users[0]
+    self.video = create_video(self.user, self.glosses[0],
+                              status=VideoStatus.WAITING_UPLOAD)
+    self.upload_id = uploads.create_session(self.video, self.user.id,
+                                            'video.mp4', 6, 'video/mp4')
+
+  def session(self):
+    return uploads.get_session(self.upload_id)
+
+  def test_concurrent_chunks(self):
+    uploads.write_chunk(self.session(), 0, io.BytesIO(b'abc'), 3)
+    # A retry of the chunk that passed the offset check concurrently.
+    with mock.patch.object(uploads, 'get_offset', return_value=0):
+      uploads.write_chunk(self.session(), 0, io.BytesIO(b'abc'), 3)
+    # A copy saved under another name by the storage.
+    default_storage.save(
+      os.path.join(uploads._session_dir(self.upload_id),
+                   '000000000000_AbCdEf' + uploads.PART_SUFFIX),
+      ContentFile(b'abc'))
+    self.assertEqual(uploads.get_offset(self.session()), 3)
+
+    uploads.write_chunk(self.session(), 3, io.BytesIO(b'def'), 3)
+    path, sha256 = uploads.finalize(self.session())
+    with default_storage.open(path) as f:
+      self.assertEqual(f.read(), b'abcdef')
+
+  def test_finalize_retry(self):
+    uploads.write_chunk(self.session(), 0, io.BytesIO(b'abcdef'), 6)
+    client = self.client_of(self.user)
+    responses = []
+    with mock.patch.object(uploads, 'probe_video',
+                           return_value={'faststart': True}):
+      for i in range(2):
+        thumbnail = SimpleUploadedFile('thumbnail.png', b'png',
+                                       content_type='image/png')
+        responses.append(client.post(
+          '/api/uploads/{}/finalize'.format(self.upload_id),
+          {'thumbnail': thumbnail}, format='multipart').json())
+
+    self.assertEqual(responses[0]['code'], 0)
+    self.assertEqual(responses[1], responses[0])
+    self.assertEqual(Score.objects.filter(
+      video=self.video, score_type=ScoreType.CREATE_VIDEO).count(), 1)
+    self.assertEqual(uploads.get_offset(self.session()), 6)
+
+  def finalize(self):
+    thumbnail = SimpleUploadedFile('thumbnail.png', b'png',
+                                   content_type='image/png')
+    with mock.patch.object(uploads, 'probe_video',
+                           return_value={'faststart': True}):
+      return self.client_of(self.user).post(
+        '/api/uploads/{}/finalize'.format(self.upload_id),
+        {'thumbnail': thumbnail}, format='multipart').json()
+
+  def test_concurrent_finalize(self):
+    uploads.write_chunk(self.session(), 0, io.BytesIO(b'abcdef'), 6)
+    stale = self.session()
+    first = self.finalize()
+
+    # A retry that read the session before the first request finished.
+    with mock.patch.object(uploads, 'get_session',
+                           side_effect=[stale, self.session()]):
+      self.assertEqual(self.finalize(), first)
+    self.assertEqual(Score.objects.filter(
+      video=self.video, score_type=ScoreType.CREATE_VIDEO).count(), 1)
+    self.assertEqual(Gloss.objects.get(
+      id=self.glosses[0].id).pending_approval_video_count, 1)
+
+  def test_failed_finalize(self):
+    uploads.write_chunk(self.session(), 0, io.BytesIO(b'abcdef'), 6)
+    with mock.patch.object(services, 'complete_upload',
+                           side_effect=RuntimeError):
+      with self.assertRaises(RuntimeError):
+        self.finalize()
+    # Only the session is left, the assembled video and thumbnail are deleted.
+    session_dir = os.path.join(self.media_root,
+                               uploads._session_dir(self.upload_id))
+    self.assertEqual(
+      [os.path.dirname(name) for name in self.media_files()],
+      [session_dir, session_dir])
+
+    self.assertEqual(self.finalize()['code'], 0)
+
+
+class UploadViewTest(MediaTestCase):
+  def setUp(self):
+    super(UploadViewTest, self).setUp()
+    self.user = self.users[0]
+    self.video = create_video(self.user, self.glosses[0],
+                              status=VideoStatus.WAITING_UPLOAD)
+
+  def request(self, size, **files):
+    files.setdefault('video', SimpleUploadedFile(
+      'video.mp4', b'\0' * size, content_type='video/mp4'))
+    request = APIRequestFactory().post(
+      '/api/videos/{}/upload'.format(self.video.uuid),
+      encode_multipart(BOUNDARY, files),
+      content_type='multipart/form-data; boundary={}'.format(BOUNDARY))
+    force_authenticate(request, self.user)
+    return request
+
+  def upload(self, request):
+    return UploadView.as_view()(request, id=self.video.uuid).data
+
+  def thumbnail(self, content_type='image/png'):
+    return SimpleUploadedFile('thumbnail.png', b'png',
+                              content_type=content_type)
+
+  def test_streamed_memory(self):
+    size = 32 * settings.UPLOAD_STREAM_CHUNK_SIZE
+    request = self.request(size, thumbnail=self.thumbnail())
+    tracemalloc.start()
+    try:
+      with mock.patch.object(uploads, 'probe_video',
+                             return_value={'faststart': True}):
+        response = self.upload(request)
+      peak = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+
+    self.assertEqual(response['code'], 0)
+    self.assertEqual(response['data']['size'], size)
+    self.assertLess(peak, size / 4)
+
+  def test_rejected_files_deleted(self):
+    cases = [
+      # The serializer is invalid.
+      ({}, 500),
+      # The serializer refuses the thumbnail.
+      ({'thumbnail': self.thumbnail('image/jpeg')}, 400),
+      # The video is not an mp4 file.
+      ({'thumbnail': self.thumbnail()}, 50074),
+    ]
+    for files, code in cases:
+      self.assertEqual(self.upload(self.request(1024, **files))['code'], code)
+      self.assertEqual(self.media_files(), [])
+
+    with mock.patch.object(uploads, 'probe_video',
+                           return_value={'faststart': True}), \
+        mock.patch.object(services, 'complete_upload',
+                          side_effect=RuntimeError):
+      with self.assertRaises(RuntimeError):
+        self.upload(self.request(1024, thumbnail=self.thumbnail()))
+    self.assertEqual(self.media_files(), [])
+
+  def test_faststart(self):
+    content = build_mp4()
+    sha256 = hashlib.sha256(content).hexdigest()
+    request = self.request(0, thumbnail=self.thumbnail(),
+                           video=SimpleUploadedFile('video.mp4', content,
+                                                    content_type='video/mp4'))
+    response = self.upload(request)['data']
+    # The upload response gives the uploaded file.
+    original = uploads.storage_name(response['video'])
+    self.assertEqual(response['sha256'], sha256)
+    with default_storage.open(original) as f:
+      self.assertEqual(f.read(), content)
+
+    self.assertEqual(processing.process_video(self.video.id),
+                     ProcessingStatus.DONE)
+    video = Video.objects.get(id=self.video.id)
+    name = uploads.storage_name(video.video_path.name)
+    self.assertNotEqual(name, original)
+    with default_storage.open(name) as f:
+      stored = f.read()
+    # The movie box follows the file type box, its chunk offset still points
+    # to the media.
+    self.assertEqual(stored[20:24], b'moov')
+    moov_end = 16 + struct.unpack('>I', stored[16:20])[0]
+    chunk = struct.unpack('>I', stored[moov_end - 4:moov_end])[0]
+    self.assertEqual(stored[chunk:chunk + 5], b'frame')
+    self.assertEqual(video.sha256, hashlib.sha256(stored).hexdigest())
+    self.assertFalse(MediaBlob.objects.filter(name=original).exists())
+
+    # Uploads announcing the checksum of the original file are stored.
+    upload_id = uploads.create_session(
+      self.video, self.user.id, 'video.mp4', len(content), 'video/mp4',
+      sha256)
+    session = uploads.get_session(upload_id)
+    self.assertEqual(uploads.get_offset(session), len(content))
+    self.assertEqual(uploads.finalize(session), (name, video.sha256))
+    self.assertEqual(MediaBlob.objects.get(name=name).source_sha256, sha256)
+
+
+class FakeBlob(object):
+  """A cloud storage blob recording the byte ranges downloaded."""
+
+  def __init__(self, content):
+    self.content = content
+    self.size = len(content)
+    self.ranges = []
+
+  def download_as_string(self, start=None, end=None):
+    self.ranges.append((start, end))
+    return self.content[start:end + 1]
+
+
+class ProbeVideoTest(TestCase):
+  def test_ranged_reads(self):
+    content = build_mp4(b'frame' * 200000)
+    blob = FakeBlob(content)
+    storage = mock.Mock(spec=['bucket', '_encode_name', '_normalize_name'])
+    storage.bucket.get_blob.return_value = blob
+    storage._encode_name.side_effect = storage._normalize_name.side_effect = \
+      lambda name: name
+    with mock.patch.object(uploads, 'default_storage', storage):
+      metadata = uploads.probe_video('video.mp4')
+
+    storage.bucket.get_blob.assert_called_once_with('video.mp4')
+    self.assertEqual(metadata, mp4.probe_file(io.BytesIO(content)))
+    # Only the file type and movie boxes are downloaded.
+    self.assertLess(sum(end + 1 - start for start, end in blob.ranges),
+                    3 * uploads.PROBE_BUFFER_SIZE)
+
+    storage.bucket.get_blob.return_value = None
+    with mock.patch.object(uploads, 'default_storage', storage):
+      with self.assertRaises(FileNotFoundError):
+        uploads.probe_video('video.mp4')
+
+
+class GlossesDownloadTest(CsltTestCase):
+  def setUp(self):
+    super(GlossesDownloadTest, self).setUp()
+    for i, duration in enumerate((0.4, 1.5, 3.0)):
+      create_video(self.users[0], self.glosses[0], status=VideoStatus.APPROVED,
+                   duration=duration)
+
+  def download(self, query):
+    return self.client.get('/admin/glosses/download?format=jsonl&' + query)
+
+  def test_duration_filter(self):
+    response = self.download('min_duration=1&max_duration=2.5')
+    self.assertEqual(response.status_code, 200)
+    rows = b''.join(response.streaming_content).splitlines()
+    self.assertEqual(len(rows), 1)
+
+  def test_invalid_duration(self):
+    for query in ('min_duration=x', 'max_duration=1s'):
+      self.assertEqual(self.download(query).status_code, 400, query)
+
+
+class CreateVideosTest(CsltTestCase):
+  def create(self, gloss_ids):
+    return self.client_of(self.users[0]).post(
+      '/api/videos', {'gloss_id': gloss_ids}, format='json').json()
+
+  def test_gloss_ids(self):
+    ids = [self.glosses[0].id, str(self.glosses[1].id)]
+    self.assertEqual(len(self.create(ids)['data']['upload_key']), 2)
+    self.assertEqual(self.create(str(self.glosses[2].id))['code'], 0)
+    for gloss_ids in (['x'], [1.5], [None], [True], [0]):
+      self.assertEqual(self.create(gloss_ids)['code'], 6701, gloss_ids)
+    self.assertEqual(Video.objects.count(), 3)
+
+  def test_query_count(self):
+    glosses = [create_gloss('many{}'.format(i)) for i in range(100)]
+    # The first videos of the day insert the counter rows.
+    services.create_videos(self.users[0], [glosses[0].id])
+    fields = [field for field in Video._meta.concrete_fields
+              if not field.primary_key]
+    queries = set()
+    for count in (1, 10, 100):
+      with CaptureQueriesContext(connection) as context:
+        services.create_videos(self.users[0],
+                               [gloss.id for gloss in glosses[:count]])
+      inserts = sum('INSERT INTO' in query['sql']
+                    for query in context.captured_queries)
+      # Some backends limit the rows inserted by one statement.
+      batch = connection.ops.bulk_batch_size(fields, [None] * count)
+      self.assertEqual(inserts, -(-count // batch))
+      queries.add(len(context) - inserts)
+    self.assertEqual(len(queries), 1, queries)
+
+
+class ThumbnailVariantTest(MediaTestCase):
+  def test_urls(self):
+    self.assertEqual(
+      thumbnail_variant_url(settings.MEDIA_URL + '2020-03/thumbnail.png'),
+      '/api/media/2020-03/thumbnail.png?w={}'.format(
+        settings.THUMBNAIL_LIST_WIDTH))
+    self.assertEqual(thumbnail_variant_url(config.NO_PIC_URL),
+                     config.NO_PIC_URL)
+    self.assertIsNone(thumbnail_variant_url(''))
+
+  def test_decompression_bomb(self):
+    output = io.BytesIO()
+    thumbnails.Image.new('RGB', (400, 300)).save(output, 'PNG')
+    name = default_storage.save('2020-03/thumbnail.png',
+                                ContentFile(output.getvalue()))
+    with mock.patch.object(thumbnails.Image, 'MAX_IMAGE_PIXELS', 1000):
+      self.assertEqual(thumbnails.get_variant(name, 160), name)
+    self.assertFalse(ThumbnailVariant.objects.exists())
+
+    self.assertEqual(thumbnails.get_variant(name, 160),
+                     thumbnails.variant_name(name, 160))
+
+
+@mock.patch.object(config, 'MEDIA_ACCEL_REDIRECT', False)
+class MediaServeTest(MediaTestCase):
+  def setUp(self):
+    super(MediaServeTest, self).setUp()
+    self.content = bytes(range(256)) * 1024
+    self.path = default_storage.save('2020-03/video.mp4',
+                                     ContentFile(self.content))
+
+  def serve(self, **headers):
+    response = media.serve(RequestFactory().get('/', **headers), self.path)
+    content = b''.join(response.streaming_content) \
+      if response.streaming else response.content
+    response.close()
+    return response, content
+
+  def test_conditional(self):
+    response, content = self.serve()
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(content, self.content)
+    etag = response['ETag']
+    self.assertEqual(self.serve(HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
+
+    response, content = self.serve(HTTP_RANGE='bytes=0-9',
+                                   HTTP_IF_RANGE='"stale"')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(content, self.content)
+
+  def test_ranges(self):
+    size = len(self.content)
+    for header, start, end in (('bytes=10-19', 10, 20),
+                               ('bytes=-5', size - 5, size),
+                               ('bytes={}-'.format(size - 7), size - 7, size),
+                               ('bytes=100-{}'.format(size * 2), 100, size)):
+      response, content = self.serve(HTTP_RANGE=header)
+      self.assertEqual(response.status_code, 206, header)
+      self.assertEqual(content, self.content[start:end], header)
+      self.assertEqual(response['Content-Range'], 'bytes {}-{}/{}'.format(
+        start, end - 1, size))
+
+    response, content = self.serve(HTTP_RANGE='bytes={}-'.format(size))
+    self.assertEqual(response.status_code, 416)
+    self.assertEqual(response['Content-Range'], 'bytes */{}'.format(size))
+
+  def test_concurrent_ranges(self):
+    # Players fetch ranges of a file in parallel, each from its own handle.
+    step = len(self.content) // 8
+    results = {}
+
+    def read(start):
+      response, content = self.serve(
+        HTTP_RANGE='bytes={}-{}'.format(start, start + step - 1))
+      results[start] = content
+
+    run_threads(read, [(start,) for start in range(0, len(self.content),
+                                                   step)])
+    self.assertEqual(b''.join(results[start] for start in sorted(results)),
+                     self.content)
+
+
+class StatisticTest(CsltTestCase):
+  def add_contributor(self, i):
+    user = User.objects.create(username='contributor{}'.format(i))
+    for status in (VideoStatus.PENDING_APPROVAL, VideoStatus.APPROVED,
+                   VideoStatus.APPROVED):
+      create_video(user, self.glosses[i % 5], status=status)
+    UserScore.objects.create(user_id=user.id,
+                             score_type=ScoreType.CREATE_VIDEO.value,
+                             total=6, count=3)
+    return user
+
+  def test_query_count(self):
+    for i in range(30):
+      self.add_contributor(i)
+      if i in (0, 9, 29):
+        cache.clear()
+        with self.assertNumQueries(3):
+          statistics = services.get_statistics()
+        self.assertEqual(len(statistics['user_stats']), i + 1)
+
+    stat = statistics['user_stats'][0]
+    self.assertEqual((stat['total_count'], stat['pending_count'],
+                      stat['approved_count'], stat['rejected_count']),
+                     (3, 1, 2, 0))
+    self.assertEqual(statistics['score_stats'][0]['total_score'], 6)
+    with self.assertNumQueries(0):
+      services.get_statistics()
+
+
+class RecordingAllocatorTest(CsltTestCase):
+  def setUp(self):
+    super(RecordingAllocatorTest, self).setUp()
+    # Rebuilds are left to the tests.
+    patcher = mock.patch.object(RecordingAllocator, 'start')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    target = settings.DEFAULT_TARGET_TRAINING_VIDEO_COUNT_PER_GLOSS
+    counts = [(1, 0), (0, 2), (target, 0), (0, 0), (0, 0)]
+    for gloss, (approved, pending) in zip(self.glosses, counts):
+      Gloss.objects.filter(id=gloss.id).update(
+        approved_video_count=approved, pending_approval_video_count=pending)
+    phrase = create_gloss('phrase')
+    Gloss.objects.filter(id=phrase.id).update(gloss_type=0)
+    recording_allocator.build()
+
+  def allocate(self, user):
+    return recording_allocator.allocate(user.id, 10)
+
+  def ids(self, *indexes):
+    return [self.glosses[i].id for i in indexes]
+
+  def test_ranking(self):
+    # The least recorded glosses come first, the complete glosses and the
+    # glosses of type 0 are left out.
+    ids = self.allocate(self.users[0])
+    self.assertEqual(set(ids[:2]), set(self.ids(3, 4)))
+    self.assertEqual(ids[2:], self.ids(0, 1))
+
+  def test_user_limit(self):
+    create_video(self.users[0], self.glosses[3])
+    create_video(self.users[0], self.glosses[3])
+    with mock.patch.object(config, 'ONE_GLOSS_RECORDING_LIMIT', 1):
+      self.assertNotIn(self.glosses[3].id, self.allocate(self.users[0]))
+      self.assertIn(self.glosses[3].id, self.allocate(self.users[1]))
+
+  def test_spread(self):
+    for i in range(20):
+      create_gloss('spread{}'.format(i))
+    recording_allocator.build()
+    users = [User.objects.create(username='spread{}'.format(i))
+             for i in range(10)]
+    firsts = {recording_allocator.allocate(user.id, 1)[0] for user in users}
+    self.assertGreater(len(firsts), 5)
+
+  @mock.patch.object(settings, 'MIN_REJECTION_COUNT_TO_REJECTED_STATUS', 1)
+  @mock.patch.object(processing, 'schedule')
+  @mock.patch.object(transaction, 'on_commit', side_effect=lambda func: func())
+  def test_counter_updates(self, on_commit, schedule):
+    user = self.users[0]
+    self.allocate(user)
+    video = Video.objects.get(
+      uuid=services.create_videos(user, [self.glosses[3].id]))
+    with mock.patch.object(config, 'ONE_GLOSS_RECORDING_LIMIT', 0):
+      # The new video counts for its user right away.
+      self.assertNotIn(self.glosses[3].id, self.allocate(user))
+
+    services.complete_upload(video, user.id, '/media/2020-03/video.mp4',
+                             '/media/2020-03/thumbnail.png')
+    ids = self.allocate(self.users[1])
+    self.assertEqual(ids[0], self.glosses[4].id)
+    self.assertEqual(set(ids[1:3]), set(self.ids(0, 3)))
+
+    services.review_videos(self.users[1].id,
+                           [(video.uuid, VideoStatus.REJECTED)])
+    ids = self.allocate(self.users[1])
+    self.assertEqual(set(ids[:2]), set(self.ids(3, 4)))
+
+  def test_background_rebuild(self):
+    recording_allocator._built_time = 0
+    with mock.patch.object(RecordingAllocator, 'build') as build:
+      self.allocate(self.users[0])
+    # Stale counters are rebuilt by the background thread, not the request.
+    build.assert_not_called()
+
+    # The process start builds in the background thread.
+    built = threading.Event()
+    with mock.patch.object(settings, 'RECORDING_ALLOCATOR_REFRESH_INTERVAL',
+                           3600), \
+        mock.patch.object(RecordingAllocator, 'build',
+                          side_effect=built.set):
+      BackgroundBuilt.start(RecordingAllocator())
+      self.assertTrue(built.wait(5))
+
+
+class GlossSearchTest(CsltTestCase):
+  def setUp(self):
+    super(GlossSearchTest, self).setUp()
+    patcher = mock.patch.object(GlossIndex, 'start')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    self.ids = {text: create_gloss(text).id
+                for text in ('你好', '你们好', '好人', 'apple', 'pineapple')}
+    gloss_index.build()
+
+  def search(self, query, prefix=False):
+    return gloss_index.search(query, prefix)
+
+  def test_exact(self):
+    self.assertEqual(self.search('你好')[0], self.ids['你好'])
+    self.assertEqual(self.search('APPLE'),
+                     [self.ids['apple'], self.ids['pineapple']])
+
+  def test_substring(self):
+    self.assertEqual(set(self.search('好')),
+                     {self.ids['你好'], self.ids['你们好'], self.ids['好人']})
+    self.assertEqual(set(self.search('pple')),
+                     {self.ids['apple'], self.ids['pineapple']})
+    self.assertEqual(self.search('你好人'), [])
+    self.assertEqual(self.search(''), [])
+
+  def test_prefix(self):
+    self.assertEqual(self.search('好', prefix=True), [self.ids['好人']])
+    self.assertEqual(self.search('app', prefix=True), [self.ids['apple']])
+
+  def test_pinyin(self):
+    self.assertEqual(search.pinyin_initials('你们好'), 'nmh')
+    self.assertEqual(self.search('nh'), [self.ids['你好']])
+    self.assertEqual(self.search('mh'), [self.ids['你们好']])
+    self.assertEqual(self.search('h', prefix=True), [self.ids['好人']])
+
+  def test_ranking_and_cap(self):
+    # Matches starting with the query, then shorter texts, come first.
+    self.assertEqual(self.search('好')[0], self.ids['好人'])
+    with mock.patch.object(settings, 'GLOSS_SEARCH_MAX_RESULTS', 1):
+      self.assertEqual(self.search('pple'), [self.ids['apple']])
+
+  def test_updates(self):
+    gloss = create_gloss('好朋友')
+    self.assertIn(gloss.id, self.search('朋友'))
+    gloss.text = '朋友'
+    gloss.save()
+    self.assertEqual(self.search('好朋'), [])
+    gloss.delete()
+    self.assertEqual(self.search('朋友'), [])
+
+  def test_glosses_api(self):
+    client = self.client_of(self.users[0])
+    response = client.get('/api/glosses/?q=pple').json()['data']
+    self.assertEqual([gloss['text'] for gloss in response['data']],
+                     ['apple', 'pineapple'])
+    response = client.get('/api/glosses/?q=').json()['data']
+    self.assertEqual(response['total'], Gloss.objects.count())
+
+
+class ReviewBatchTest(CsltTestCase):
+  def setUp(self):
+    super(ReviewBatchTest, self).setUp()
+    self.videos = [create_video(self.users[0], gloss)
+                   for gloss in self.glosses[:2]]
+    self.client = self.client_of(self.users[1])
+
+  def review(self, reviews):
+    return self.client.post('/api/review/batch', {'reviews': reviews},
+                            format='json').json()
+
+  def test_reviews(self):
+    response = self.review([
+      {'uuid': self.videos[0].uuid, 'action': 'approve'},
+      {'uuid': self.videos[1].uuid, 'action': 'reject'},
+      {'uuid': str(uuid.uuid4()), 'action': 'approve'},
+    ])
+    self.assertEqual(response['code'], 0)
+    self.assertEqual([result['code'] for result in response['data']['results']],
+                     [0, 0, 404])
+    self.assertEqual(Score.objects.filter(
+      user_id=self.users[1].id, score_type=ScoreType.REVIEW_VIDEO).count(), 2)
+
+  def test_invalid_reviews(self):
+    for reviews in ([], None, [{'uuid': self.videos[0].uuid}],
+                    [{'uuid': {'a': 1}, 'action': 'approve'}],
+                    [{'uuid': ['a'], 'action': 'approve'}],
+                    [{'uuid': self.videos[0].uuid, 'action': 'skip'}],
+                    [{'uuid': self.videos[0].uuid, 'action': 'approve'}] *
+                    (settings.REVIEW_BATCH_LIMIT + 1)):
+      self.assertEqual(self.review(reviews)['code'], 6701, reviews)
+    self.assertFalse(Score.objects.exists())
+
+
+@mock.patch.object(settings, 'MIN_APPROVAL_COUNT_TO_APPROVAL_STATUS', 2)
+@mock.patch.object(settings, 'MIN_REJECTION_COUNT_TO_REJECTED_STATUS', 2)
+@mock.patch.object(processing, 'schedule')
+class ReviewQueueTest(CsltTestCase):
+  def queue(self):
+    return sorted(ReviewQueue.objects.values_list(
+      'video_id', 'user_id', 'created_time', 'approved_count',
+      'rejected_count'))
+
+  def upload(self, video):
+    services.complete_upload(video, video.user_id, '/media/2020-03/video.mp4',
+                             '/media/2020-03/thumbnail.png')
+
+  def review(self, user, video, action):
+    services.review_videos(user.id, [(video.uuid, action)])
+
+  def test_status_changes(self, schedule):
+    owner, first, second = self.users
+    video = create_video(owner, self.glosses[0],
+                         status=VideoStatus.WAITING_UPLOAD)
+    self.assertEqual(self.queue(), [])
+
+    self.upload(video)
+    self.assertEqual(self.queue(),
+                     [(video.id, owner.id, video.created_time, 0, 0)])
+
+    # The votes are copied until the video is decided.
+    self.review(first, video, VideoStatus.REJECTED)
+    self.assertEqual(self.queue(),
+                     [(video.id, owner.id, video.created_time, 0, 1)])
+    ReviewLease.objects.create(video=video, user=second, leased_time=0,
+                               expires_time=int(time.time()) + 60)
+    self.review(second, video, VideoStatus.REJECTED)
+    self.assertEqual(self.queue(), [])
+    self.assertFalse(ReviewLease.objects.exists())
+
+    # A new upload of the rejected video queues it again.
+    video.refresh_from_db()
+    self.upload(video)
+    self.assertEqual(len(self.queue()), 1)
+
+  def test_approval(self, schedule):
+    owner, first, second = self.users
+    video = create_video(owner, self.glosses[0])
+    self.review(first, video, VideoStatus.APPROVED)
+    self.assertEqual(self.queue()[0][3:], (1, 0))
+    self.review(second, video, VideoStatus.APPROVED)
+    self.assertEqual(self.queue(), [])
+
+  def test_rebuild(self, schedule):
+    owner, first, second = self.users
+    videos = [create_video(owner, gloss) for gloss in self.glosses[:4]]
+    self.review(first, videos[0], VideoStatus.APPROVED)
+    self.review(first, videos[1], VideoStatus.REJECTED)
+    self.review(first, videos[2], VideoStatus.APPROVED)
+    self.review(second, videos[2], VideoStatus.APPROVED)
+    create_video(owner, self.glosses[4], status=VideoStatus.APPROVED)
+    queue = self.queue()
+    self.assertEqual([row[0] for row in queue],
+                     [videos[0].id, videos[1].id, videos[3].id])
+
+    call_command('rebuild_review_queue', stdout=io.StringIO())
+    self.assertEqual(self.queue(), queue)
+
+    # Drifted rows are rebuilt from the videos.
+    ReviewQueue.objects.filter(video_id=videos[0].id).delete()
+    ReviewQueue.objects.filter(video_id=videos[1].id).update(rejected_count=5)
+    ReviewQueue.objects.create(video_id=videos[2].id, user_id=owner.id,
+                               created_time=0)
+    call_command('rebuild_review_queue', stdout=io.StringIO())
+    self.assertEqual(self.queue(), queue)
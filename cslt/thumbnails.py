@@ -0,0 +1,117 @@
+"""
+Resized variants of video thumbnails.
+
+Phones upload full size PNG thumbnails. A variant is a JPEG copy scaled down
+to one of settings.THUMBNAIL_WIDTHS, generated on first request and stored
+next to the original, e.g. 2020-03/<uuid>.w160.jpg for 2020-03/<uuid>.png.
+Variants are tracked by ThumbnailVariant rows; when their total size exceeds
+settings.THUMBNAIL_CACHE_BUDGET, the least recently used ones are deleted.
+
+Pillow is optional: without it, the originals are served.
+"""
+import io
+import logging
+import os.path
+import time
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError
+from django.db.models import Sum
+
+from cslt import settings
+from cslt.models import ThumbnailVariant
+
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def variant_width(width):
+  """Return the smallest variant width not below width, or the largest."""
+  for variant in sorted(settings.THUMBNAIL_WIDTHS):
+    if variant >= width:
+      return variant
+  return max(settings.THUMBNAIL_WIDTHS)
+
+
+def variant_name(name, width):
+  return '{}.w{}.jpg'.format(os.path.splitext(name)[0], width)
+
+
+def _render(name, width):
+  with default_storage.open(name) as f:
+    image = Image.open(f)
+    image.load()
+  if image.width > width:
+    image.thumbnail((width, image.height * width // image.width + 1),
+                    Image.LANCZOS)
+  output = io.BytesIO()
+  image.convert('RGB').save(output, 'JPEG', quality=settings.THUMBNAIL_QUALITY,
+                            optimize=True)
+  return output.getvalue()
+
+
+def evict(budget=None):
+  """
+  Delete the least recently used variants until their total size fits in
+  budget, settings.THUMBNAIL_CACHE_BUDGET by default.
+
+  :return: the number of deleted variants.
+  """
+  if budget is None:
+    budget = settings.THUMBNAIL_CACHE_BUDGET
+  total = ThumbnailVariant.objects.aggregate(total=Sum('size'))['total'] or 0
+  evicted = 0
+  for id, name, size in ThumbnailVariant.objects.order_by(
+      'accessed_time', 'id').values_list('id', 'name', 'size').iterator():
+    if total <= budget:
+      break
+    ThumbnailVariant.objects.filter(id=id).delete()
+    default_storage.delete(name)
+    total -= size
+    evicted += 1
+  return evicted
+
+
+def get_variant(name, width):
+  """
+  Return the storage name of the variant of the image name for a width,
+  generating it if needed, or name itself if no variant can be made.
+  """
+  if Image is None or not name.lower().endswith(IMAGE_EXTENSIONS):
+    return name
+  width = variant_width(width)
+  variant = variant_name(name, width)
+  now = int(time.time())
+
+  stored = ThumbnailVariant.objects.filter(name=variant).values_list(
+    'id', 'accessed_time').first()
+  if stored is not None:
+    if now - stored[1] >= settings.THUMBNAIL_ACCESS_RESOLUTION:
+      ThumbnailVariant.objects.filter(id=stored[0]).update(accessed_time=now)
+    return variant
+
+  try:
+    data = _render(name, width)
+  except (OSError, ValueError, Image.DecompressionBombError) as e:
+    logger.warning('Cannot make thumbnail variant of %s: %s', name, e)
+    return name
+  if default_storage.exists(variant):
+    default_storage.delete(variant)
+  saved = default_storage.save(variant, ContentFile(data))
+  if saved != variant:
+    # Saved by a concurrent request in the meantime.
+    default_storage.delete(saved)
+  try:
+    ThumbnailVariant.objects.create(name=variant, source=name, width=width,
+                                    size=len(data), accessed_time=now)
+  except IntegrityError:
+    return variant
+  evict()
+  return variant
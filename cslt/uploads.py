@@ -0,0 +1,519 @@
+"""
+Resumable video uploads.
+
+An upload session lives in the temporary area of the storage backend,
+UPLOAD_TMP_DIR/<upload id>/, as a session.json file describing the upload
+and one part file per received chunk, named after the chunk offset. Chunks
+must be sent in order, the session offset is the end of the run of parts
+starting at 0. Finalizing the session concatenates the parts into the
+uploaded video. The response is then recorded in the session and the parts
+deleted, a retried finalize request gets the same response until the
+session is purged.
+
+The one-shot upload endpoint streams the video of its multipart body into the
+storage backend with StorageUploadHandler.
+
+Uploaded videos are content addressed: a MediaBlob row maps the sha256 of
+each stored video file to its storage name. An upload of content already
+stored references the stored file and drops its own copy, see acquire_blob.
+"""
+import hashlib
+import io
+import json
+import logging
+import os.path
+import re
+import time
+import uuid
+
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, \
+  StopFutureHandlers
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q
+from storages.utils import clean_name
+
+from cslt import mp4, settings
+from cslt.models import MediaBlob
+from cslt.serializers import get_upload_url
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_TMP_DIR = 'tmp/uploads'
+SESSION_FILE = 'session.json'
+PART_SUFFIX = '.part'
+
+# Video fields filled from the mp4.probe results of the uploaded file.
+METADATA_FIELDS = ('duration', 'width', 'height', 'fps')
+
+# Bytes downloaded by each ranged read of open_header.
+PROBE_BUFFER_SIZE = 64 * 1024
+
+
+def create_file(file_name):
+  """
+  Create a new upload file named like file_name in the storage.
+
+  :return: the storage name of the file and the file, opened for writing.
+  """
+  # Saving an empty file reserves the name and creates its directory.
+  name = default_storage.save(get_upload_url(file_name), ContentFile(b''))
+  return name, default_storage.open(name, 'wb')
+
+
+def storage_name(path):
+  """Return the storage name of a video or thumbnail path of the database."""
+  path = str(path)
+  if path.startswith(settings.MEDIA_URL):
+    return path[len(settings.MEDIA_URL):]
+  return path
+
+
+def check_metadata(metadata):
+  """
+  Check the probed metadata of an uploaded video.
+
+  :raise InvalidMp4: if the video is shorter than settings.MIN_VIDEO_DURATION.
+  """
+  if metadata['duration'] < settings.MIN_VIDEO_DURATION:
+    raise mp4.InvalidMp4('Video too short: {:.2f}s'.format(
+      metadata['duration']))
+
+
+class BlobRangeReader(io.RawIOBase):
+  """
+  Seekable read-only file over a cloud storage blob, where each read is a
+  ranged download of the bytes read, so that reading the mp4 header boxes
+  does not download the media data.
+  """
+
+  def __init__(self, blob):
+    super().__init__()
+    self._blob = blob
+    self._position = 0
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def tell(self):
+    return self._position
+
+  def seek(self, offset, whence=io.SEEK_SET):
+    if whence == io.SEEK_CUR:
+      offset += self._position
+    elif whence == io.SEEK_END:
+      offset += self._blob.size
+    if offset < 0:
+      raise ValueError('Negative seek position {}'.format(offset))
+    self._position = offset
+    return offset
+
+  def readinto(self, b):
+    end = min(self._position + len(b), self._blob.size)
+    if end <= self._position:
+      return 0
+    # The end of a blob download range is included.
+    data = self._blob.download_as_string(start=self._position, end=end - 1)
+    b[:len(data)] = data
+    self._position += len(data)
+    return len(data)
+
+
+def open_header(name):
+  """
+  Open a stored file to read its header. On cloud storage, the file is read
+  with ranged downloads instead of being downloaded as a whole on opening.
+  """
+  if not hasattr(default_storage, 'bucket'):
+    return default_storage.open(name)
+  # Blob names are resolved like GoogleCloudStorage._open does.
+  blob = default_storage.bucket.get_blob(default_storage._encode_name(
+    default_storage._normalize_name(clean_name(name))))
+  if blob is None:
+    raise FileNotFoundError('File does not exist: {}'.format(name))
+  return io.BufferedReader(BlobRangeReader(blob), PROBE_BUFFER_SIZE)
+
+
+def probe_video(name):
+  """
+  Probe a stored mp4 file, see mp4.probe.
+
+  :raise InvalidMp4: if the file is malformed or fails check_metadata.
+  """
+  with open_header(name) as f:
+    metadata = mp4.probe_file(f)
+  check_metadata(metadata)
+  return metadata
+
+
+def find_blob(sha256):
+  """
+  Return the stored video file of content sha256, or made faststart from a
+  file of content sha256, None if there is none.
+  """
+  return MediaBlob.objects.filter(
+    Q(sha256=sha256) | Q(source_sha256=sha256)).first()
+
+
+def acquire_blob(sha256, name=None, source_sha256=None):
+  """
+  Reference the stored video file of content sha256 from a video.
+
+  :param name: the storage name of a new file of that content. It becomes
+    the stored file if there is none, and is deleted otherwise.
+  :param source_sha256: the sha256 of the upload name was made faststart
+    from, see processing.make_faststart.
+  :return: the storage name of the referenced file, None if no file of that
+    content is stored and name is None.
+  """
+  with transaction.atomic():
+    blob = MediaBlob.objects.select_for_update().filter(
+      Q(sha256=sha256) | Q(source_sha256=sha256)).first()
+    if blob is None:
+      if name is None:
+        return None
+      try:
+        with transaction.atomic():
+          MediaBlob.objects.create(sha256=sha256, name=name,
+                                   source_sha256=source_sha256,
+                                   size=default_storage.size(name),
+                                   ref_count=1, created_time=int(time.time()))
+        return name
+      except IntegrityError:
+        # Stored by a concurrent upload in the meantime.
+        blob = MediaBlob.objects.select_for_update().get(sha256=sha256)
+    MediaBlob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1)
+
+  if name is not None and name != blob.name:
+    transaction.on_commit(lambda: default_storage.delete(name))
+  return blob.name
+
+
+def release_blob(name):
+  """
+  Drop a video reference to a stored video file, deleting the file with its
+  last reference. Files stored before content addressing are kept.
+  """
+  with transaction.atomic():
+    blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+    if blob is None:
+      return
+    if blob.ref_count > 1:
+      MediaBlob.objects.filter(id=blob.id).update(
+        ref_count=F('ref_count') - 1)
+      return
+    blob.delete()
+  transaction.on_commit(lambda: default_storage.delete(name))
+
+
+def discard_file(name):
+  """Delete a stored file of a rejected upload, unless it is a shared blob."""
+  if not MediaBlob.objects.filter(name=name).exists():
+    default_storage.delete(name)
+
+
+class OffsetMismatch(Exception):
+  """A chunk does not start at the current offset of its session."""
+
+  def __init__(self, offset):
+    super(OffsetMismatch, self).__init__(offset)
+    self.offset = offset
+
+
+def _session_dir(upload_id):
+  return os.path.join(UPLOAD_TMP_DIR, upload_id)
+
+
+def create_session(video, user_id, filename, size, content_type,
+                   sha256=None):
+  """
+  Start a resumable upload of the video file of a video.
+
+  :param sha256: the checksum of the file, if the client knows it. When a
+    file of that content and size is stored already, the session is complete
+    without any chunk.
+  :return: the upload id.
+  :raise ValueError: if the upload is not acceptable.
+  """
+  if content_type != 'video/mp4':
+    raise ValueError('The uploaded file is not supported ' + str(content_type))
+  if not 0 < size <= settings.UPLOAD_MAX_SIZE:
+    raise ValueError('Invalid upload size')
+  if sha256 is not None and not re.match(r'^[0-9a-f]{64}$', str(sha256)):
+    raise ValueError('Invalid sha256')
+
+  upload_id = uuid.uuid4().hex
+  session = {
+    'uuid': video.uuid,
+    'user_id': user_id,
+    'filename': os.path.basename(filename),
+    'size': size,
+    'sha256': sha256,
+    'created_time': int(time.time()),
+  }
+  default_storage.save(os.path.join(_session_dir(upload_id), SESSION_FILE),
+                       ContentFile(json.dumps(session).encode()))
+  return upload_id
+
+
+def get_session(upload_id):
+  """Return the description of an upload session, or None if unknown."""
+  try:
+    upload_id = uuid.UUID(hex=upload_id).hex
+  except ValueError:
+    return None
+
+  name = os.path.join(_session_dir(upload_id), SESSION_FILE)
+  if not default_storage.exists(name):
+    return None
+  with default_storage.open(name) as f:
+    session = json.loads(f.read().decode())
+  session['upload_id'] = upload_id
+  return session
+
+
+def _parts(session):
+  """
+  List the (offset, name, size) of the received parts in order, up to the
+  first missing byte.
+  """
+  directory = _session_dir(session['upload_id'])
+  found = []
+  for name in default_storage.listdir(directory)[1]:
+    if not name.endswith(PART_SUFFIX):
+      continue
+    try:
+      offset = int(name[:-len(PART_SUFFIX)])
+    except ValueError:
+      # Not a part, e.g. a copy saved under another name.
+      continue
+    name = os.path.join(directory, name)
+    found.append((offset, name, default_storage.size(name)))
+
+  parts = []
+  end = 0
+  for offset, name, size in sorted(found):
+    if offset > end:
+      break
+    # Parts starting before the end were superseded by a resent chunk.
+    if offset == end and size:
+      parts.append((offset, name, size))
+      end += size
+  return parts
+
+
+def _stored_blob(session, parts):
+  """Return the stored file of the content announced by a session, if any."""
+  if parts or not session.get('sha256'):
+    return None
+  blob = find_blob(session['sha256'])
+  if blob is None or blob.size != session['size']:
+    return None
+  return blob
+
+
+def get_offset(session):
+  """Return the number of bytes received by an upload session."""
+  if session.get('response') is not None:
+    return session['size']
+  parts = _parts(session)
+  if _stored_blob(session, parts) is not None:
+    return session['size']
+  return sum(size for offset, name, size in parts)
+
+
+def write_chunk(session, offset, stream, length):
+  """
+  Store the next chunk of an upload session, read from stream.
+
+  :return: the session offset after the chunk.
+  :raise OffsetMismatch: if the chunk does not start at the session offset.
+  :raise ValueError: if the chunk is too large or exceeds the upload size.
+  """
+  current = get_offset(session)
+  if offset != current:
+    raise OffsetMismatch(current)
+  if not 0 < length <= settings.UPLOAD_CHUNK_MAX_SIZE or \
+      offset + length > session['size']:
+    raise ValueError('Invalid chunk size')
+
+  data = stream.read(length)
+  if len(data) != length:
+    raise ValueError('Incomplete chunk')
+  # Concurrent retries of a chunk write the same part, the storage would
+  # save a copy under another name instead of replacing it.
+  with default_storage.open(
+      os.path.join(_session_dir(session['upload_id']),
+                   '{:012d}{}'.format(offset, PART_SUFFIX)), 'wb') as f:
+    f.write(data)
+  return offset + length
+
+
+class _ConcatenatedParts(io.RawIOBase):
+  """A readable stream over the parts of an upload session, in order."""
+
+  def __init__(self, names):
+    self._names = list(names)
+    self._current = None
+    self.sha256 = hashlib.sha256()
+
+  def readable(self):
+    return True
+
+  def readinto(self, buffer):
+    while True:
+      if self._current is None:
+        if not self._names:
+          return 0
+        self._current = default_storage.open(self._names.pop(0))
+      data = self._current.read(len(buffer))
+      if data:
+        buffer[:len(data)] = data
+        self.sha256.update(data)
+        return len(data)
+      self._current.close()
+      self._current = None
+
+  def close(self):
+    if self._current is not None:
+      self._current.close()
+    super(_ConcatenatedParts, self).close()
+
+
+def finalize(session):
+  """
+  Assemble the parts of a complete upload session into the uploaded video.
+  The parts are kept until close_session.
+
+  :return: the storage name and the sha256 of the video. The name is the one
+    of the stored file when the session announced stored content.
+  :raise ValueError: if the upload is not complete.
+  """
+  parts = _parts(session)
+  blob = _stored_blob(session, parts)
+  if blob is not None:
+    return blob.name, blob.sha256
+  if sum(size for offset, name, size in parts) != session['size']:
+    raise ValueError('Upload not complete')
+
+  stream = _ConcatenatedParts(name for offset, name, size in parts)
+  content = File(io.BufferedReader(stream), session['filename'])
+  content.size = session['size']
+  try:
+    path = default_storage.save(get_upload_url(session['filename']), content)
+  finally:
+    content.close()
+  return path, stream.sha256.hexdigest()
+
+
+def close_session(session, response):
+  """
+  Record the response of a finalized upload session, given again to retried
+  finalize requests, and delete the session parts.
+  """
+  directory = _session_dir(session['upload_id'])
+  description = {key: value for key, value in session.items()
+                 if key != 'upload_id'}
+  description['response'] = response
+  with default_storage.open(os.path.join(directory, SESSION_FILE),
+                            'wb') as f:
+    f.write(json.dumps(description).encode())
+  for name in default_storage.listdir(directory)[1]:
+    if name != SESSION_FILE:
+      default_storage.delete(os.path.join(directory, name))
+
+
+def delete_session(session):
+  """Delete the parts and description of an upload session."""
+  directory = _session_dir(session['upload_id'])
+  for name in default_storage.listdir(directory)[1]:
+    default_storage.delete(os.path.join(directory, name))
+  try:
+    # Directories only exist on file system storages.
+    default_storage.delete(directory)
+  except Exception:
+    logger.warning('Could not delete upload directory %s', directory)
+
+
+def purge_sessions(max_age):
+  """
+  Delete the upload sessions older than max_age seconds.
+
+  :return: the number of deleted sessions.
+  """
+  if not default_storage.exists(UPLOAD_TMP_DIR):
+    return 0
+
+  purged = 0
+  for upload_id in default_storage.listdir(UPLOAD_TMP_DIR)[0]:
+    session = get_session(upload_id)
+    if session is None:
+      continue
+    if time.time() - session['created_time'] > max_age:
+      delete_session(session)
+      purged += 1
+  return purged
+
+
+class StoredUpload(UploadedFile):
+  """A file of a multipart body already written to the storage backend."""
+
+  def __init__(self, storage_name, name, content_type, size, sha256):
+    super(StoredUpload, self).__init__(None, name, content_type, size)
+    self.storage_name = storage_name
+    self.sha256 = sha256
+
+  def open(self, mode='rb'):
+    return default_storage.open(self.storage_name, mode)
+
+
+class StorageUploadHandler(FileUploadHandler):
+  """
+  Write the mp4 files of a multipart body straight to the storage backend,
+  settings.UPLOAD_STREAM_CHUNK_SIZE bytes at a time, computing their size and
+  sha256 on the way. Other files are left to the next handlers.
+  """
+  chunk_size = settings.UPLOAD_STREAM_CHUNK_SIZE
+
+  def __init__(self, request=None):
+    super(StorageUploadHandler, self).__init__(request)
+    self.destination = None
+
+  def new_file(self, field_name, file_name, content_type, *args, **kwargs):
+    super(StorageUploadHandler, self).new_file(
+      field_name, file_name, content_type, *args, **kwargs)
+    if content_type != 'video/mp4':
+      self.destination = None
+      return
+
+    self.storage_name, self.destination = create_file(file_name)
+    self.sha256 = hashlib.sha256()
+    self.size = 0
+    raise StopFutureHandlers()
+
+  def receive_data_chunk(self, raw_data, start):
+    if self.destination is None:
+      return raw_data
+    self.destination.write(raw_data)
+    self.sha256.update(raw_data)
+    self.size += len(raw_data)
+    return None
+
+  def file_complete(self, file_size):
+    if self.destination is None:
+      return None
+    self.destination.close()
+    self.destination = None
+    return StoredUpload(self.storage_name, self.file_name, self.content_type,
+                        self.size, self.sha256.hexdigest())
+
+  def upload_interrupted(self):
+    if self.destination is not None:
+      self.destination.close()
+      self.destination = None
+      default_storage.delete(self.storage_name)
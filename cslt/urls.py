@@ -19,10 +19,15 @@ urlpatterns = [
   path('api/categories/<int:id>', CategoryView.as_view(), name='category'),
   path('api/videos/<slug:id>', VideoView.as_view(), name='video'),
   path('api/videos', VideoView.as_view(), name='videos'),
+  path('api/review/batch', ReviewBatchView.as_view(), name='review-videos'),
+  path('api/review/tasks', ReviewTaskView.as_view(), name='review-tasks'),
   re_path(r'^api/review/(?P<uuid>[0-9a-f\-]{36})/(?P<action>\b(approve|reject)\b)$', ScoreView.as_view(), name='review-video'),
   path('api/profile/', ProfileView.as_view()),
   #path('api/profile/statics', StatisticView.as_view()),
   path('api/videos/<slug:id>/upload', UploadView.as_view()),
+  path('api/videos/<slug:id>/uploads', ResumableUploadView.as_view()),
+  path('api/uploads/<slug:upload_id>', UploadSessionView.as_view()),
+  path('api/uploads/<slug:upload_id>/finalize', UploadFinalizeView.as_view()),
   re_path('api/media/(?P<path>.+)', AuthMediaView.as_view()),
   path('api/bunch/', BunchView.as_view()),
   path('api/glosses/', GlossView.as_view()),
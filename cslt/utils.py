@@ -1,9 +1,14 @@
 import json
+import logging
+import threading
+import time
 from enum import Enum
 
-from django.db import models
+from django.db import connection, models
 from django.core.serializers.json import DjangoJSONEncoder
 
+logger = logging.getLogger(__name__)
+
 
 class JSONField(models.TextField):
   """
@@ -72,3 +77,57 @@ class Convert(models.Func):
     self.function = 'CONVERT'
     self.template = '%(function)s(%(expressions)s USING %(transcoding_name)s)'
     return super(Convert, self).as_sql(compiler, connection)
+
+
+class BackgroundBuilt(object):
+  """
+  Base of the in-process structures loaded from the database. The structure
+  is built on first use, or by start() when the process starts, then rebuilt
+  every refresh_interval() seconds by a daemon thread, so that requests only
+  apply the changes made by this process.
+
+  Subclasses implement build, which sets _built_time, and refresh_interval.
+  """
+  thread_name = 'background-build'
+
+  def __init__(self):
+    self._built_time = None
+    self._build_lock = threading.Lock()
+    self._thread_lock = threading.Lock()
+    self._thread = None
+
+  def build(self):
+    raise NotImplementedError
+
+  def refresh_interval(self):
+    raise NotImplementedError
+
+  def ensure_built(self):
+    """Build the structure if it never was, and start the rebuilds."""
+    if self._built_time is None:
+      with self._build_lock:
+        if self._built_time is None:
+          self.build()
+    if self._thread is None:
+      self.start()
+
+  def start(self):
+    """Start the thread rebuilding the structure, building it first."""
+    with self._thread_lock:
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._rebuild,
+                                        name=self.thread_name, daemon=True)
+        self._thread.start()
+
+  def _rebuild(self):
+    while True:
+      with self._build_lock:
+        if self._built_time is None or \
+            time.time() - self._built_time >= self.refresh_interval():
+          try:
+            self.build()
+          except Exception:
+            logger.exception('%s failed', self.thread_name)
+          finally:
+            connection.close()
+      time.sleep(self.refresh_interval())
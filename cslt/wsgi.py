@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cslt.settings")
 
 application = get_wsgi_application()
+
+# Load the in-process gloss structures off the request path.
+from cslt.allocator import recording_allocator
+from cslt.search import gloss_index
+
+recording_allocator.start()
+gloss_index.start()
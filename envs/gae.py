@@ -10,6 +10,7 @@ SECRET_KEY = '<<secret_key>>'
 STATIC_URL = 'https://storage.googleapis.com/cslt-211408.appspot.com/static/'
 MEDIA_ROOT = ''
 MEDIA_URL = 'media/'
+MEDIA_ACCEL_REDIRECT = False
 SIMPLE_JWT_ACCESS_TOKEN_LIFETIME = timedelta(days=7)
 SIMPLE_JWT_REFRESH_TOKEN_LIFETIME = timedelta(days=30)
 SIMPLE_JWT_SLIDING_TOKEN_LIFETIME = timedelta(days=7)
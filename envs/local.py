@@ -11,6 +11,7 @@ SECRET_KEY = ''
 STATIC_URL = '/static/'
 MEDIA_ROOT = os.getenv('CSLT_MEDIA_ROOT', '')
 MEDIA_URL = '/media/'
+MEDIA_ACCEL_REDIRECT = False
 SIMPLE_JWT_ACCESS_TOKEN_LIFETIME = timedelta(days=7)
 SIMPLE_JWT_REFRESH_TOKEN_LIFETIME = timedelta(days=30)
 SIMPLE_JWT_SLIDING_TOKEN_LIFETIME = timedelta(days=7)
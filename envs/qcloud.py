@@ -11,6 +11,8 @@ SECRET_KEY = ''
 STATIC_URL = '/media/static/'
 MEDIA_ROOT = os.getenv('CSLT_MEDIA_ROOT', '')
 MEDIA_URL = '/media/'
+# Media files are sent by the nginx in front of the app.
+MEDIA_ACCEL_REDIRECT = True
 SIMPLE_JWT_ACCESS_TOKEN_LIFETIME = timedelta(days=7)
 SIMPLE_JWT_REFRESH_TOKEN_LIFETIME = timedelta(days=30)
 SIMPLE_JWT_SLIDING_TOKEN_LIFETIME = timedelta(days=7)